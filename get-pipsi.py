@@ -3,7 +3,7 @@ import argparse
 import os
 import shutil
 import sys
-from subprocess import call, check_output
+from subprocess import call
 import textwrap
 
 
@@ -48,12 +48,30 @@ def succeed(msg):
     sys.exit(0)
 
 
+def find_executable(cmd):
+    if IS_WIN:
+        cmd += '.exe'
+    for path in os.environ.get('PATH', '').split(os.pathsep):
+        exe = os.path.join(path, cmd)
+        if os.path.isfile(exe) and os.access(exe, os.X_OK):
+            return exe
+
+
 def command_exists(cmd):
-    with open(os.devnull, 'w') as null:
+    # Looking up PATH is much cheaper than spawning the command
+    return find_executable(cmd) is not None
+
+
+def pipsi_works():
+    # A pipsi whose venv interpreter is gone has to be reinstalled, which
+    # only running it can tell
+    pipsi = find_executable('pipsi')
+    if pipsi is None:
+        return False
+    with open(os.devnull, 'w') as devnull:
         try:
-            return call(
-                [cmd, '--version'],
-                stdout=null, stderr=null) == 0
+            return call([pipsi, '--version'], stdout=devnull,
+                        stderr=devnull) == 0
         except OSError:
             return False
 
@@ -68,7 +86,30 @@ def publish_script(venv, bin_dir):
     echo('Installed pipsi binary in ' + bin_dir)
 
 
-def install_files(venv, bin_dir, install):
+def copy_venv_template(template, venv):
+    """Copies a prebuilt pipsi virtualenv and rewrites the paths that
+    point into it.
+    """
+    template = os.path.abspath(template)
+    venv = os.path.abspath(venv)
+    shutil.copytree(template, venv, symlinks=True)
+
+    old, new = template.encode('utf-8'), venv.encode('utf-8')
+    bin_dir = os.path.join(venv, os.path.dirname(PIP).strip('/'))
+    paths = [os.path.join(venv, 'pyvenv.cfg')]
+    paths.extend(os.path.join(bin_dir, name) for name in os.listdir(bin_dir))
+    for path in paths:
+        if os.path.islink(path) or not os.path.isfile(path):
+            continue
+        with open(path, 'rb') as f:
+            data = f.read()
+        if b'\0' in data or old not in data:
+            continue
+        with open(path, 'wb') as f:
+            f.write(data.replace(old, new))
+
+
+def install_files(venv, bin_dir, install, pip_args=(), template=None):
     try:
         os.makedirs(bin_dir)
     except OSError:
@@ -80,11 +121,23 @@ def install_files(venv, bin_dir, install):
         except (OSError, IOError):
             pass
 
+    if template:
+        if os.path.exists(venv):
+            # Never clean up a venv this run did not create
+            fail('Could not copy the virtualenv template: %s already '
+                 'exists' % venv)
+        try:
+            copy_venv_template(template, venv)
+        except (OSError, IOError) as e:
+            _cleanup()
+            fail('Could not copy the virtualenv template: %s' % e)
+        publish_script(venv, bin_dir)
+        return
 
     if sys.version_info.major < 3:
         executable = sys.executable
     else:
-        executable = get_real_python(sys.executable)
+        executable = get_real_python()
         print('sys.executable={} sys.real_prefix={} executable={}'.format(sys.executable, getattr(sys, 'real_prefix', None), executable))
     venv_cmd = [executable, '-m', venv_pkg]
     if venv_pkg == 'virtualenv':
@@ -95,7 +148,7 @@ def install_files(venv, bin_dir, install):
         _cleanup()
         fail('Could not create virtualenv for pipsi :(')
 
-    if call([venv + PIP, 'install', install]) != 0:
+    if call([venv + PIP, 'install'] + list(pip_args) + [install]) != 0:
         _cleanup()
         fail('Could not install pipsi :(')
 
@@ -131,6 +184,30 @@ def parse_options(argv):
             'Default: %(default)s'
         ),
     )
+    parser.add_argument(
+        '--wheel',
+        help=(
+            'Install pipsi from this local wheel instead of --src, without '
+            'accessing the package index.  Dependencies are looked up next '
+            'to the wheel and in --find-links.'
+        ),
+    )
+    parser.add_argument(
+        '--find-links',
+        action='append',
+        default=[],
+        help=(
+            'A local folder with wheels to install pipsi and its dependencies '
+            'from, without accessing the package index.  Can be repeated.'
+        ),
+    )
+    parser.add_argument(
+        '--venv-template',
+        help=(
+            'A prebuilt pipsi virtualenv to copy instead of creating a new '
+            'one and running pip.  Not supported on Windows.'
+        ),
+    )
     parser.add_argument(
         '--no-modify-path',
         action='store_true',
@@ -147,23 +224,14 @@ def parse_options(argv):
     return parser.parse_args(argv)
 
 
-code_for_get_real_python = (
-    'import sys; print("{},{}".format('
-    'getattr(sys, "real_prefix", ""), '
-    'sys.version_info.major))'
-)
-
-
-def get_real_python(python):
-    cmd = [python, '-c', code_for_get_real_python]
-    out = check_output(cmd)
-    if not isinstance(out, str):
-        out = out.decode()
-    real_prefix, major = out.strip().split(',')
+def get_real_python():
+    # This script runs under the interpreter in question, so there is no
+    # need to spawn it to look at its prefix
+    real_prefix = getattr(sys, 'real_prefix', '')
     if not real_prefix:
-        return python
+        return sys.executable
 
-    for i in [major, '']:
+    for i in [str(sys.version_info.major), '']:
         real_python = os.path.join(real_prefix, 'bin', 'python' + i)
         if os.path.exists(real_python):
             return real_python
@@ -214,21 +282,40 @@ def ensure_pipsi_on_path(bin_dir, modify_path):
             ))
 
 
+def get_pip_args(args):
+    """The pip options and the requirement to install pipsi with."""
+    install = args.src
+    find_links = list(args.find_links)
+    if args.wheel:
+        install = os.path.abspath(args.wheel)
+        find_links.insert(0, os.path.dirname(install))
+    pip_args = ['--disable-pip-version-check']
+    if find_links:
+        pip_args.append('--no-index')
+        for path in find_links:
+            pip_args += ['--find-links', os.path.abspath(path)]
+    return pip_args, install
+
+
 def main(argv=sys.argv[1:]):
     args = parse_options(argv)
 
-    if command_exists('pipsi') and not args.ignore_existing:
+    if not args.ignore_existing and pipsi_works():
         succeed('You already have pipsi installed')
     elif os.path.exists(os.path.join(args.bin_dir, 'pipsi')):
         ensure_pipsi_on_path(args.bin_dir, not args.no_modify_path)
         succeed('pipsi is now installed')
 
     echo('Installing pipsi')
-    if venv_pkg is None:
+    if args.venv_template and IS_WIN:
+        # The .exe launchers embed the path of the template's python
+        fail('--venv-template is not supported on Windows.')
+    if venv_pkg is None and not args.venv_template:
         fail('You need to have virtualenv installed to bootstrap pipsi.')
 
     venv = os.path.join(args.home_dir, 'pipsi')
-    install_files(venv, args.bin_dir, args.src)
+    pip_args, install = get_pip_args(args)
+    install_files(venv, args.bin_dir, install, pip_args, args.venv_template)
     ensure_pipsi_on_path(args.bin_dir, not args.no_modify_path)
     succeed('pipsi is now installed.')
 
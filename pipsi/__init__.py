@@ -1,5 +1,8 @@
 from __future__ import print_function
+import base64
+import csv
 import json
+import math
 import os
 import pkgutil
 import sys
@@ -11,6 +14,21 @@ from os.path import join, realpath, dirname, normpath, normcase
 from operator import methodcaller
 import distutils.spawn
 import re
+import errno
+import stat
+import hashlib
+import io
+import shlex
+import signal
+import socket
+import tarfile
+import tempfile
+import threading
+import time
+import zipfile
+from io import BytesIO
+from contextlib import contextmanager
+from multiprocessing.pool import ThreadPool
 try:
     subprocess.run
 
@@ -29,12 +47,22 @@ except AttributeError:  # no `subprocess.run`, py < 3.5
         out, err = map(proc_output, p.communicate())
         return CompletedProcess(argv, p.returncode, out, err)
 try:
-    from urlparse import urlparse
+    from urlparse import urlparse, urljoin
+    from urllib import unquote, url2pathname, getproxies, proxy_bypass
+    from HTMLParser import HTMLParser
+    import httplib
 except ImportError:
-    from urllib.parse import urlparse
+    from urllib.parse import urlparse, urljoin, unquote
+    from urllib.request import url2pathname, getproxies, proxy_bypass
+    from html.parser import HTMLParser
+    import http.client as httplib
+try:
+    from os import scandir
+except ImportError:  # py < 3.5
+    scandir = None
 
 import click
-from pkg_resources import Requirement
+from pkg_resources import Requirement, parse_version
 
 
 try:
@@ -48,6 +76,20 @@ else:
 
 FIND_SCRIPTS_SCRIPT = pkgutil.get_data('pipsi', 'scripts/find_scripts.py').decode('utf-8')
 GET_VERSION_SCRIPT = pkgutil.get_data('pipsi', 'scripts/get_version.py').decode('utf-8')
+GET_ENTRY_POINTS_SCRIPT = pkgutil.get_data('pipsi', 'scripts/get_entry_points.py').decode('utf-8')
+ZIPAPP_MAIN_TEMPLATE = pkgutil.get_data('pipsi', 'scripts/zipapp_main.py').decode('utf-8')
+
+# Dependencies that are installed once per interpreter into the shared
+# layer, when enabled
+SHARED_PACKAGES = ('click', 'requests', 'urllib3', 'six', 'pyyaml')
+SHARED_LAYER_PTH = '_pipsi_shared.pth'
+
+# Records the completed phases of an install or upgrade in progress, see
+# `Repo.get_journal`
+JOURNAL_FILE = 'pipsi-journal.json'
+
+# Upper bound of worker threads used for concurrent per-venv work
+DEFAULT_WORKERS = 8
 
 # The `click` custom context settings
 CONTEXT_SETTINGS = dict(
@@ -67,6 +109,19 @@ def proc_output(s):
     return s
 
 
+def parallel_map(func, items, workers=DEFAULT_WORKERS):
+    """Like `map` but runs `func` over a thread pool, preserving order."""
+    items = list(items)
+    if len(items) < 2:
+        return list(map(func, items))
+    pool = ThreadPool(min(workers, len(items)))
+    try:
+        return pool.map(func, items)
+    finally:
+        pool.close()
+        pool.join()
+
+
 def normalize_package(value):
     # Strips the version and normalizes name
     requirement = Requirement.parse(value)
@@ -85,30 +140,152 @@ def real_readlink(filename):
     return normpath(realpath(join(dirname(filename), target)))
 
 
-def publish_script(src, dst):
+if hasattr(os, 'replace'):
+    replace_file = os.replace
+else:  # py2
+    def replace_file(src, dst):
+        if IS_WIN and os.path.lexists(dst):
+            # Renaming onto an existing file fails on windows
+            os.remove(dst)
+        os.rename(src, dst)
+
+
+def prepare_script(src, dst):
+    """Creates the link (or copy on windows) of `src` under a temporary
+    name next to `dst` and returns that name.
+    """
+    tmp = join(dirname(dst), '.%s.%d.pipsi-tmp' % (os.path.basename(dst),
+                                                  os.getpid()))
+    if os.path.lexists(tmp):
+        os.remove(tmp)
     if IS_WIN:
-        # always copy new exe on windows
-        shutil.copy(src, dst)
-        click.echo('  Copied Executable ' + dst)
-        return True
+        shutil.copy(src, tmp)
     else:
-        old_target = real_readlink(dst)
-        if old_target == src:
-            return True
+        os.symlink(src, tmp)
+    return tmp
+
+
+def get_venv_python(virtualenv):
+    return join(virtualenv, BIN_DIR, 'python.exe' if IS_WIN else 'python')
+
+
+def read_pyvenv_cfg(virtualenv):
+    """Parse `pyvenv.cfg` of a virtualenv into a dict, empty if missing."""
+    rv = {}
+    try:
+        with open(join(virtualenv, 'pyvenv.cfg')) as fh:
+            for line in fh:
+                key, sep, value = line.partition('=')
+                if sep:
+                    rv[key.strip().lower()] = value.strip()
+    except (OSError, IOError):
+        pass
+    return rv
+
+
+def _iter_dir(path):
+    """Yields ``(name, is_dir, stat, inode)`` for the entries of `path`
+    without following symlinks.  `stat` is None for directories.
+    """
+    if scandir is None:
+        for name in os.listdir(path):
+            try:
+                st = os.lstat(join(path, name))
+            except OSError:
+                continue
+            if stat.S_ISDIR(st.st_mode):
+                yield name, True, None, None
+            else:
+                yield name, False, st, st.st_ino
+        return
+    for entry in scandir(path):
         try:
-            os.remove(dst)
+            if entry.is_dir(follow_symlinks=False):
+                yield entry.name, True, None, None
+            else:
+                st = entry.stat(follow_symlinks=False)
+                # `st_ino` is not filled in by `scandir` on windows
+                yield entry.name, False, st, st.st_ino or entry.inode()
         except OSError:
             pass
+
+
+def scan_tree(path):
+    """Walks `path` and returns ``(dirs, files)``.
+
+    `dirs` maps every directory, relative to `path`, to its mtime and
+    `files` lists ``[dev, inode, nlink, size]`` for every other entry,
+    size being the allocated size where the platform reports it.
+    """
+    dirs = {}
+    files = []
+    stack = ['']
+    while stack:
+        rel = stack.pop()
+        current = join(path, rel)
+        try:
+            dirs[rel] = os.stat(current).st_mtime
+            entries = list(_iter_dir(current))
+        except OSError:
+            continue
+        for name, is_dir, st, inode in entries:
+            if is_dir:
+                stack.append(join(rel, name))
+                continue
+            blocks = getattr(st, 'st_blocks', None)
+            size = blocks * 512 if blocks is not None else st.st_size
+            files.append([st.st_dev, inode, st.st_nlink, size])
+    return dirs, files
+
+
+def tree_unchanged(path, dirs):
+    """Checks the directory mtimes recorded by `scan_tree`."""
+    for rel, mtime in dirs.items():
         try:
-            os.symlink(src, dst)
+            if os.stat(join(path, rel)).st_mtime != mtime:
+                return False
+        except OSError:
+            return False
+    return True
+
+
+def write_json(path, data):
+    """Atomically replaces `path` with `data` dumped as JSON."""
+    if not os.path.isdir(dirname(path)):
+        try:
+            os.makedirs(dirname(path))
         except OSError:
             pass
-        else:
-            click.echo('  Linked script ' + dst)
-            return True
+    tmp_path = '%s.%d.%d.tmp' % (path, os.getpid(),
+                                 threading.current_thread().ident)
+    with open(tmp_path, 'w') as fh:
+        json.dump(data, fh)
+    replace_file(tmp_path, path)
+
+
+def format_size(size):
+    for unit in 'BKMGT':
+        if size < 1024 or unit == 'T':
+            break
+        size /= 1024.0
+    if unit == 'B':
+        return '%d%s' % (size, unit)
+    return '%.1f%s' % (size, unit)
+
+
+DiskUsage = namedtuple('DiskUsage', ('unique', 'shared'))
 
 
 def extract_package_version(virtualenv, package):
+    """The installed version of `package`, read from its metadata and
+    only asked from the venv's interpreter if that is not found.
+    """
+    path = find_distribution(virtualenv, package)[0]
+    if path is not None:
+        version = read_metadata(path).get('version')
+        if version:
+            return version
+
     prefix = normalize(join(virtualenv, BIN_DIR, ''))
 
     return run([
@@ -117,13 +294,257 @@ def extract_package_version(virtualenv, package):
     ]).stdout.strip()
 
 
+def extract_entry_points(virtualenv, package):
+    """Maps the console scripts of `package` to their entry points."""
+    path = find_distribution(virtualenv, package)[0]
+    if path is not None:
+        return read_entry_points(join(path, 'entry_points.txt'))
+
+    prefix = normalize(join(virtualenv, BIN_DIR, ''))
+
+    r = run([
+        join(prefix, 'python'), '-c', GET_ENTRY_POINTS_SCRIPT,
+        package,
+    ])
+    try:
+        return json.loads(r.stdout)
+    except ValueError:
+        return {}
+
+
+def find_site_packages(virtualenv):
+    """The site-packages folder of a venv, found without running it."""
+    if IS_WIN:
+        candidates = [join(virtualenv, 'Lib', 'site-packages')]
+    else:
+        candidates = []
+        match = re.match(r'\d+\.\d+', read_pyvenv_cfg(virtualenv).get(
+            'version') or '')
+        if match is not None:
+            candidates.append(join(virtualenv, 'lib', 'python' +
+                                   match.group(0), 'site-packages'))
+        candidates.extend(sorted(glob.glob(
+            join(virtualenv, 'lib', 'python*', 'site-packages'))))
+    for path in candidates:
+        if os.path.isdir(path):
+            return path
+
+
+def list_distributions(virtualenv):
+    """The `*.dist-info` and `*.egg-info` entries of the site-packages."""
+    site_packages = find_site_packages(virtualenv)
+    if site_packages is None:
+        return set()
+    return set(name for name in os.listdir(site_packages)
+               if name.endswith(('.dist-info', '.egg-info')))
+
+
+def distribution_name(entry):
+    # Strips the version and suffix, eg. from "foo_bar-1.0.dist-info"
+    return entry.rsplit('.', 1)[0].split('-', 1)[0]
+
+
+def get_distribution_key(name):
+    return re.sub(r'[-_.]+', '_', name).lower()
+
+
+def find_distribution(virtualenv, package):
+    """Locates the `*.dist-info` or `*.egg-info` of `package` in
+    `virtualenv` without running its interpreter.
+
+    Returns ``(path, project)`` where `project` is the source folder of a
+    development install made through an `.egg-link`, None otherwise.
+    `path` is None if the metadata cannot be found.
+    """
+    site_packages = find_site_packages(virtualenv)
+    if site_packages is None:
+        return None, None
+    key = get_distribution_key(package)
+    entries = os.listdir(site_packages)
+    for entry in entries:
+        if not entry.endswith('.egg-link') or \
+           get_distribution_key(entry[:-len('.egg-link')]) != key:
+            continue
+        with open(join(site_packages, entry)) as fh:
+            lines = [line.strip() for line in fh if line.strip()]
+        egg_path = lines[0]
+        project = normpath(join(egg_path, lines[1] if len(lines) > 1 else '.'))
+        for name in glob.glob(join(egg_path, '*.egg-info')):
+            if get_distribution_key(
+                    distribution_name(os.path.basename(name))) == key:
+                return name, project
+        return None, project
+    for entry in entries:
+        if entry.endswith(('.dist-info', '.egg-info')) and \
+           get_distribution_key(distribution_name(entry)) == key:
+            return join(site_packages, entry), None
+    return None, None
+
+
+def find_entry_points_file(virtualenv, package):
+    """Locates the `entry_points.txt` of `package` in `virtualenv`, see
+    `find_distribution`.
+    """
+    path, project = find_distribution(virtualenv, package)
+    if path is None:
+        return None, project
+    return join(path, 'entry_points.txt'), project
+
+
+def open_metadata(path):
+    # Metadata files are UTF-8, whatever the locale says
+    return io.open(path, encoding='utf-8', errors='replace')
+
+
+def read_metadata(path):
+    """Parses the headers of the `METADATA` or `PKG-INFO` of the
+    distribution at `path` into a dict with lowercased keys.
+    """
+    if os.path.isdir(path):
+        candidates = [join(path, 'METADATA'), join(path, 'PKG-INFO')]
+    else:
+        # A distutils install writes PKG-INFO as the `.egg-info` file
+        candidates = [path]
+    for filename in candidates:
+        rv = {}
+        try:
+            with open_metadata(filename) as fh:
+                # The long description after the headers is not needed
+                for line in fh:
+                    if not line.strip():
+                        break
+                    if line[:1].isspace() or ':' not in line:
+                        # Continuation lines of multi-line headers
+                        continue
+                    key, value = line.split(':', 1)
+                    rv.setdefault(key.strip().lower(), value.strip())
+        except (OSError, IOError):
+            continue
+        return rv
+    return {}
+
+
+def read_installed_files(path):
+    """The files installed with the distribution at `path`, from its
+    `RECORD` or `installed-files.txt`.  None if neither is there.
+    """
+    try:
+        with open_metadata(join(path, 'RECORD')) as fh:
+            if sys.version_info[0] < 3:
+                # The csv module of py2 only handles byte strings
+                names = [row[0].decode('utf-8') for row in csv.reader(
+                    line.encode('utf-8') for line in fh) if row]
+            else:
+                names = [row[0] for row in csv.reader(fh) if row]
+        return [normpath(join(dirname(path), name)) for name in names]
+    except (OSError, IOError):
+        pass
+    try:
+        with open_metadata(join(path, 'installed-files.txt')) as fh:
+            return [normpath(join(path, line.strip().split(',')[0]))
+                    for line in fh if line.strip()]
+    except (OSError, IOError):
+        return None
+
+
+def parse_entry_points(text, group='console_scripts'):
+    """Maps the names in a group of an `entry_points.txt` to their
+    entry points.
+    """
+    rv = {}
+    section = None
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line.startswith(('#', ';')):
+            continue
+        if line.startswith('[') and line.endswith(']'):
+            section = line[1:-1].strip()
+        elif section == group and '=' in line:
+            name, value = line.split('=', 1)
+            rv[name.strip()] = value.strip()
+    return rv
+
+
+def read_entry_points(path):
+    try:
+        with open_metadata(path) as fh:
+            return parse_entry_points(fh.read())
+    except (OSError, IOError):
+        return {}
+
+
+def get_mtime(path):
+    try:
+        return os.stat(path).st_mtime
+    except (OSError, TypeError):
+        return None
+
+
+def metadata_outdated(path, project):
+    """Whether the egg-info at `path` is older than the setup files of
+    `project`.
+    """
+    mtime = get_mtime(path)
+    if mtime is None:
+        return True
+    for name in 'setup.py', 'setup.cfg', 'pyproject.toml':
+        setup_mtime = get_mtime(join(project, name))
+        if setup_mtime is not None and setup_mtime > mtime:
+            return True
+    return False
+
+
+SCRIPT_TEMPLATE = '''#!%(python)s
+# -*- coding: utf-8 -*-
+import re
+import sys
+from %(module)s import %(import_name)s
+if __name__ == '__main__':
+    sys.argv[0] = re.sub(r'(-script\\.pyw|\\.exe)?$', '', sys.argv[0])
+    sys.exit(%(func)s())
+'''
+
+
+def write_script(virtualenv, name, entry_point):
+    """Writes a console script wrapper like pip does, returns its path."""
+    module, _, func = entry_point.split()[0].partition(':')
+    path = join(virtualenv, BIN_DIR, name)
+    with open(path, 'w') as fh:
+        fh.write(SCRIPT_TEMPLATE % {
+            'python': get_venv_python(virtualenv),
+            'module': module,
+            'import_name': func.split('.')[0],
+            'func': func,
+        })
+    os.chmod(path, 0o755)
+    return path
+
+
+def link_shared_layer(virtualenv, shared_site_packages):
+    """Makes the packages of a shared layer importable from `virtualenv`.
+
+    The `.pth` entry comes after the venv's own site-packages, so packages
+    installed into the venv take precedence.
+    """
+    with open(join(find_site_packages(virtualenv), SHARED_LAYER_PTH), 'w') as fh:
+        fh.write(shared_site_packages + '\n')
+
+
 def find_scripts(virtualenv, package):
     prefix = normalize(join(virtualenv, BIN_DIR, ''))
 
-    files = run([
-        join(prefix, 'python'), '-c', FIND_SCRIPTS_SCRIPT,
-        package, prefix
-    ]).stdout.splitlines()
+    path = find_distribution(virtualenv, package)[0]
+    if path is not None:
+        files = read_installed_files(path)
+        if files is None:
+            files = [join(prefix, name) for name in
+                     read_entry_points(join(path, 'entry_points.txt'))]
+    else:
+        # Not on the filesystem where we expect it, ask the interpreter
+        files = run([
+            join(prefix, 'python'), '-c', FIND_SCRIPTS_SCRIPT,
+            package, prefix
+        ]).stdout.splitlines()
 
     files = map(normalize, files)
     files = filter(
@@ -144,6 +565,41 @@ def find_scripts(virtualenv, package):
     return result
 
 
+def pid_alive(pid):
+    if IS_WIN:
+        # `os.kill` would terminate the process, ask the kernel instead
+        import ctypes
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.OpenProcess(
+            0x1000, False, pid)  # PROCESS_QUERY_LIMITED_INFORMATION
+        if not handle:
+            # Access is denied to processes that exist
+            return kernel32.GetLastError() == 5  # ERROR_ACCESS_DENIED
+        try:
+            code = ctypes.c_ulong()
+            if not kernel32.GetExitCodeProcess(handle, ctypes.byref(code)):
+                return True
+            return code.value == 259  # STILL_ACTIVE
+        finally:
+            kernel32.CloseHandle(handle)
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno == errno.EPERM
+    return True
+
+
+def remove_path(path):
+    try:
+        if os.path.isdir(path) and not os.path.islink(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+    except (OSError, IOError):
+        return False
+    return True
+
+
 class UninstallInfo(object):
 
     def __init__(self, package, paths=None, installed=True):
@@ -159,6 +615,543 @@ class UninstallInfo(object):
                 shutil.rmtree(path)
 
 
+Garbage = namedtuple('Garbage', ('kind', 'path', 'size'))
+
+
+class GarbageInfo(object):
+
+    def __init__(self, repo, items=None):
+        self.repo = repo
+        self.items = items or []
+
+    @property
+    def size(self):
+        return sum(item.size for item in self.items)
+
+    def perform(self):
+        """Removes all items concurrently, returns the failed ones."""
+        def remove(item):
+            if item.kind != 'orphaned venv':
+                return remove_path(item.path)
+            # Hold the lock while removing, so no install can start in
+            # a half deleted venv
+            try:
+                with self.repo.lock(os.path.basename(item.path)):
+                    return remove_path(item.path)
+            except click.UsageError:
+                # An install started since the items were collected
+                return False
+        removed = parallel_map(remove, self.items)
+        return [item for item, ok in zip(self.items, removed) if not ok]
+
+
+pyc_tag_regex = re.compile(r'\.(cpython-\d+)(?:\.opt-\d+)?\.pyc$')
+
+
+def get_cpython_tag(virtualenv):
+    """The bytecode tag (eg. ``cpython-36``) of a venv's interpreter,
+    None if it is unknown or not CPython.
+    """
+    cfg = read_pyvenv_cfg(virtualenv)
+    if cfg.get('implementation', 'cpython').lower() != 'cpython':
+        return None
+    match = re.match(r'(\d+)\.(\d+)',
+                     cfg.get('version') or cfg.get('version_info') or '')
+    if match is None:
+        return None
+    return 'cpython-%s%s' % match.groups()
+
+
+def find_stale_bytecode(virtualenv):
+    """Yields `Garbage` for bytecode compiled by interpreters other than
+    the one of `virtualenv`.  Whole `__pycache__` folders are yielded when
+    nothing in them is in use anymore.
+    """
+    tag = get_cpython_tag(virtualenv)
+    if tag is None:
+        return
+    for root, dirs, files in os.walk(virtualenv):
+        if os.path.basename(root) != '__pycache__':
+            continue
+        stale = []
+        for name in files:
+            match = pyc_tag_regex.search(name)
+            if match is not None and match.group(1) != tag:
+                stale.append(join(root, name))
+        sizes = []
+        for path in stale:
+            try:
+                sizes.append(os.lstat(path).st_size)
+            except OSError:
+                sizes.append(0)
+        if stale and len(stale) == len(files) and not dirs:
+            yield Garbage('stale bytecode', root, sum(sizes))
+        else:
+            for path, size in zip(stale, sizes):
+                yield Garbage('stale bytecode', path, size)
+
+
+ARCHIVE_MANIFEST = 'pipsi-export.json'
+
+
+def get_archive_mode(filename):
+    """The streaming `tarfile` write mode matching the extension of
+    `filename`, gzip by default.
+    """
+    for suffixes, compression in ((('.tar.bz2', '.tbz2'), 'bz2'),
+                                  (('.tar.xz', '.txz'), 'xz'),
+                                  (('.tar',), '')):
+        if filename.endswith(suffixes):
+            return 'w|' + compression
+    return 'w|gz'
+
+
+def relocate_path(path, replacements):
+    for old, new in replacements:
+        if path == old or path.startswith(join(old, '')):
+            return new + path[len(old):]
+    return path
+
+
+def relocate_json(value, replacements):
+    if isinstance(value, dict):
+        return dict((k, relocate_json(v, replacements))
+                    for k, v in value.items())
+    if isinstance(value, list):
+        return [relocate_json(v, replacements) for v in value]
+    if isinstance(value, type(u'')):
+        return relocate_path(value, replacements)
+    return value
+
+
+def relocate_file(name, data, replacements):
+    """Rewrites the absolute paths in the contents of the venv file
+    `name` (relative to the venv) that depend on its location.
+    """
+    encoding = sys.getfilesystemencoding()
+    byte_replacements = [(old.encode(encoding), new.encode(encoding))
+                         for old, new in replacements]
+    if name == 'package_info.json':
+        info = json.loads(data.decode('utf-8'))
+        return json.dumps(relocate_json(info, replacements)).encode('utf-8')
+    if name.startswith(BIN_DIR + '/') and data.startswith(b'#!') and \
+       not os.path.basename(name).startswith('activate'):
+        shebang, sep, rest = data.partition(b'\n')
+        if rest.startswith(b"'''exec' "):
+            # The /bin/sh trampoline pip writes for long interpreter paths
+            line, sep2, rest = rest.partition(b'\n')
+            shebang += sep + line
+            sep = sep2
+        for old, new in byte_replacements:
+            shebang = shebang.replace(old, new)
+        return shebang + sep + rest
+    if name == 'pyvenv.cfg' or name.endswith(('.pth', '.egg-link')) or \
+       name.startswith(BIN_DIR + '/activate'):
+        for old, new in byte_replacements:
+            data = data.replace(old, new)
+    return data
+
+
+# Distributions that are only needed to manage a venv
+PACK_EXCLUDED = ('pip', 'wheel', '_distutils_hack', '__pycache__')
+NATIVE_SUFFIXES = ('.so', '.pyd', '.dylib')
+
+code_for_compile_legacy = (
+    'import compileall, sys; '
+    'kw = {"legacy": True} if sys.version_info[0] > 2 else {}; '
+    'sys.exit(not compileall.compile_dir(sys.argv[1], quiet=1, **kw))'
+)
+
+
+def collect_pack_files(site_packages):
+    """Lists the files of `site_packages` that go into a zipapp,
+    relative to it, along with the native extensions among them.
+    """
+    files = []
+    native = []
+    for root, dirs, filenames in os.walk(site_packages):
+        rel_root = os.path.relpath(root, site_packages)
+        if rel_root == '.':
+            rel_root = ''
+            dirs[:] = [d for d in dirs if d.split('-')[0] not in PACK_EXCLUDED]
+        else:
+            dirs[:] = [d for d in dirs if d != '__pycache__']
+        for name in filenames:
+            path = join(rel_root, name)
+            if not rel_root and (name.endswith('.egg-link') or
+                                 name.startswith('__editable__')):
+                raise click.UsageError(
+                    'Editable installs cannot be packed (%s)' % name)
+            if name.endswith(('.pyc', '.pyo', '.pth')):
+                continue
+            if name.endswith(NATIVE_SUFFIXES):
+                native.append(path)
+            files.append(path)
+    return sorted(files), native
+
+
+def get_pack_top_level(path):
+    """What a file collected by `collect_pack_files` belongs to: the
+    distribution of a metadata folder, the top-level module otherwise.
+    """
+    first = path.replace(os.sep, '/').split('/')[0]
+    if first.endswith(('.dist-info', '.egg-info')):
+        return 'dist:' + get_distribution_key(distribution_name(first))
+    return first.split('.')[0]
+
+
+DEFAULT_INDEX_URL = 'https://pypi.org/simple/'
+DIST_EXTENSIONS = ('.whl', '.tar.gz', '.tar.bz2', '.tar.xz', '.zip', '.tgz')
+
+
+def canonicalize_name(name):
+    return re.sub(r'[-_.]+', '-', name).lower()
+
+
+def parse_dist_version(filename, name):
+    """The version of the wheel or sdist `filename` of project `name`,
+    None if it is not one.
+    """
+    for ext in DIST_EXTENSIONS:
+        if filename.endswith(ext):
+            stem = filename[:-len(ext)]
+            break
+    else:
+        return None
+    parts = stem.split('-')
+    if ext == '.whl':
+        if len(parts) >= 5 and canonicalize_name(parts[0]) == name:
+            return parts[1]
+        return None
+    for i in range(1, len(parts)):
+        if canonicalize_name('-'.join(parts[:i])) == name:
+            return '-'.join(parts[i:])
+
+
+class LinkParser(HTMLParser):
+    """Collects the file names linked from a PEP 503 project page."""
+
+    def __init__(self):
+        HTMLParser.__init__(self)
+        self.filenames = []
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == 'a' and attrs.get('href') and 'data-yanked' not in attrs:
+            path = urlparse(attrs['href']).path
+            self.filenames.append(unquote(path.rstrip('/').rsplit('/', 1)[-1]))
+
+
+def parse_project_page(html):
+    parser = LinkParser()
+    parser.feed(html)
+    parser.close()
+    return parser.filenames
+
+
+def split_credentials(url):
+    """Removes the credentials from `url`.  Returns the url and the value
+    of the matching basic `Authorization` header, or None.
+    """
+    parsed = urlparse(url)
+    if parsed.username is None:
+        return url, None
+    credentials = '%s:%s' % (unquote(parsed.username),
+                             unquote(parsed.password or ''))
+    url = parsed._replace(netloc=parsed.netloc.rpartition('@')[2]).geturl()
+    return url, 'Basic ' + base64.b64encode(
+        credentials.encode('utf-8')).decode('ascii')
+
+
+class IndexClient(object):
+    """Looks up the released versions of projects on a PEP 503 simple
+    index, which can also be a local `file://` index or a plain folder of
+    wheels and sdists.
+
+    HTTP connections are reused per thread and host and go through the
+    proxies configured in the environment.  Credentials in the index url
+    are sent as basic auth.  Responses are cached in `cache_dir` and
+    revalidated with ETag and Last-Modified once their max-age has passed.
+    """
+
+    def __init__(self, index_url, cache_dir):
+        index_url, self.authorization = split_credentials(index_url)
+        self.index_url = index_url.rstrip('/') + '/'
+        self.cache_dir = join(cache_dir, hashlib.sha1(
+            self.index_url.encode('utf-8')).hexdigest()[:16])
+        self._local = threading.local()
+
+    def get_versions(self, project):
+        name = canonicalize_name(project)
+        if urlparse(self.index_url).scheme == 'file':
+            filenames = self._get_local_filenames(name)
+        else:
+            filenames = self._get_remote_filenames(name)
+        versions = set()
+        for filename in filenames:
+            version = parse_dist_version(filename, name)
+            if version is not None:
+                versions.add(version)
+        return sorted(versions)
+
+    def _get_local_filenames(self, name):
+        path = url2pathname(urlparse(self.index_url).path)
+        project_dir = join(path, name)
+        if os.path.isfile(join(project_dir, 'index.html')):
+            with open(join(project_dir, 'index.html'), 'rb') as fh:
+                return parse_project_page(fh.read().decode('utf-8'))
+        if os.path.isdir(project_dir):
+            return os.listdir(project_dir)
+        # A flat folder of distributions, like for `pip --find-links`
+        return os.listdir(path)
+
+    def _connect(self, parsed):
+        """Opens a connection for the url `parsed`.  Returns it along with
+        whether requests go to an HTTP proxy and the headers they need.
+        """
+        https = parsed.scheme == 'https'
+        cls = httplib.HTTPSConnection if https else httplib.HTTPConnection
+        port = parsed.port or (443 if https else 80)
+        proxy = getproxies().get(parsed.scheme)
+        if not proxy or proxy_bypass(parsed.hostname):
+            return cls(parsed.hostname, port, timeout=30), False, {}
+
+        if '://' not in proxy:
+            proxy = 'http://' + proxy
+        proxy, proxy_authorization = split_credentials(proxy)
+        proxy = urlparse(proxy)
+        if proxy.scheme != 'http':
+            raise IOError('Only http:// proxies are supported, not %s'
+                          % proxy.geturl())
+        proxy_headers = {}
+        if proxy_authorization is not None:
+            proxy_headers['Proxy-Authorization'] = proxy_authorization
+        if https:
+            conn = cls(proxy.hostname, proxy.port or 80, timeout=30)
+            conn.set_tunnel(parsed.hostname, port, proxy_headers)
+            return conn, False, {}
+        return cls(proxy.hostname, proxy.port or 80, timeout=30), True, \
+            proxy_headers
+
+    def _request(self, url, headers, redirects=3):
+        parsed = urlparse(url)
+        connections = self._local.__dict__.setdefault('connections', {})
+        key = (parsed.scheme, parsed.netloc)
+        path = parsed.path + ('?' + parsed.query if parsed.query else '')
+        for attempt in range(2):
+            if key not in connections:
+                connections[key] = self._connect(parsed)
+            conn, proxied, proxy_headers = connections[key]
+            # Built for every request, so that redirects to other hosts
+            # never carry the credentials
+            request_headers = dict(headers)
+            if self.authorization is not None and \
+               parsed.netloc == urlparse(self.index_url).netloc:
+                request_headers['Authorization'] = self.authorization
+            try:
+                if proxied:
+                    request_headers.update(proxy_headers)
+                    conn.request('GET', '%s://%s%s' % (
+                        parsed.scheme, parsed.netloc, path),
+                        headers=request_headers)
+                else:
+                    conn.request('GET', path, headers=request_headers)
+                response = conn.getresponse()
+                body = response.read()
+                break
+            except (httplib.HTTPException, socket.error):
+                # The server may have closed the kept-alive connection
+                conn.close()
+                del connections[key]
+                if attempt:
+                    raise
+        location = response.getheader('location')
+        if response.status in (301, 302, 303, 307, 308) and location \
+           and redirects:
+            return self._request(urljoin(url, location), headers,
+                                 redirects - 1)
+        return response, body
+
+    def _get_remote_filenames(self, name):
+        cache_path = join(self.cache_dir, name + '.json')
+        try:
+            with open(cache_path) as fh:
+                cached = json.load(fh)
+        except (OSError, IOError, ValueError):
+            cached = None
+
+        if cached is not None and cached.get('expires', 0) > time.time():
+            return cached['filenames']
+
+        headers = {'Accept': 'text/html', 'Cache-Control': 'max-age=0'}
+        if cached is not None:
+            if cached.get('etag'):
+                headers['If-None-Match'] = cached['etag']
+            if cached.get('last_modified'):
+                headers['If-Modified-Since'] = cached['last_modified']
+
+        response, body = self._request(
+            urljoin(self.index_url, name + '/'), headers)
+        if response.status == 304 and cached is not None:
+            filenames = cached['filenames']
+        elif response.status == 200:
+            filenames = parse_project_page(body.decode('utf-8', 'replace'))
+        elif response.status == 404:
+            filenames = []
+        else:
+            raise IOError('%s returned HTTP %d' % (name, response.status))
+
+        match = re.search(r'max-age=(\d+)',
+                          response.getheader('cache-control') or '')
+        write_json(cache_path, {
+            'filenames': filenames,
+            'etag': response.getheader('etag') or
+            (cached or {}).get('etag'),
+            'last_modified': response.getheader('last-modified') or
+            (cached or {}).get('last_modified'),
+            'expires': time.time() + int(match.group(1)) if match else 0,
+        })
+        return filenames
+
+
+Outdated = namedtuple('Outdated', ('name', 'installed', 'latest'))
+
+
+importtime_regex = re.compile(r'^import time:\s*(\d+)\s*\|\s*(\d+)\s*\|(\s*)(\S+)')
+
+try:
+    timer = time.perf_counter
+except AttributeError:  # py < 3.3
+    timer = time.time
+
+
+def percentile(values, percent):
+    """Nearest-rank percentile of `values`."""
+    values = sorted(values)
+    index = int(math.ceil(percent / 100.0 * len(values))) - 1
+    return values[min(max(index, 0), len(values) - 1)]
+
+
+def is_python_script(path):
+    """Whether the script at `path` runs with python, judged from its
+    shebang and pip's /bin/sh trampoline for long interpreter paths.
+    """
+    try:
+        with open(path, 'rb') as fh:
+            head = fh.read(1024).split(b'\n')[:2]
+    except (OSError, IOError):
+        return False
+    if not head[0].startswith(b'#!'):
+        return False
+    if b'python' in head[0]:
+        return True
+    return len(head) > 1 and head[1].startswith(b"'''exec'") and \
+        b'python' in head[1]
+
+
+def run_timed(cmd, timeout, env=None):
+    """Runs `cmd` without stdin and measures how long it takes.
+
+    Returns ``(seconds, returncode, stderr)``, where `returncode` is None
+    if the process was killed after `timeout` seconds.
+    """
+    killed = []
+    kwargs = {}
+    if not IS_WIN:
+        # Its own process group, so that children holding on to the
+        # output pipes are killed along with it
+        kwargs['preexec_fn'] = os.setsid
+
+    def kill():
+        killed.append(True)
+        try:
+            if IS_WIN:
+                p.kill()
+            else:
+                os.killpg(p.pid, signal.SIGKILL)
+        except OSError:
+            pass
+
+    with open(os.devnull, 'rb') as stdin:
+        start = timer()
+        p = subprocess.Popen(cmd, stdin=stdin, stdout=subprocess.PIPE,
+                             stderr=subprocess.PIPE, env=env, **kwargs)
+        watchdog = threading.Timer(timeout, kill)
+        watchdog.start()
+        try:
+            out, err = p.communicate()
+        finally:
+            watchdog.cancel()
+        elapsed = timer() - start
+    return elapsed, None if killed else p.returncode, proc_output(err)
+
+
+def profile_script(virtualenv, script, runs, args=(), top=10, timeout=10):
+    """Runs `script` of `virtualenv` `runs` times and measures how long
+    it takes to start.
+
+    The first run is reported as cold start, the others as warm starts.
+    Python scripts on python 3.7 and later run with
+    ``PYTHONPROFILEIMPORTTIME`` set, and the modules that take longest to
+    import are reported.  Runs get no stdin, and a run that takes longer
+    than `timeout` seconds is killed and ends the profiling.
+    """
+    version = read_pyvenv_cfg(virtualenv).get('version') or ''
+    match = re.match(r'(\d+)\.(\d+)', version)
+    python = is_python_script(script)
+    env = None
+    if python and match is not None and \
+       tuple(map(int, match.groups())) >= (3, 7):
+        env = dict(os.environ, PYTHONPROFILEIMPORTTIME='1')
+
+    cmd = [script] + list(args)
+    timings = []
+    imports = []
+    returncode = None
+    timed_out = False
+    for i in range(runs):
+        elapsed, returncode, stderr = run_timed(cmd, timeout, env)
+        if returncode is None:
+            timed_out = True
+            break
+        timings.append(elapsed)
+        modules = {}
+        for line in stderr.splitlines():
+            m = importtime_regex.match(line)
+            if m is not None:
+                modules[m.group(4)] = (int(m.group(1)), int(m.group(2)))
+        imports.append(modules)
+
+    # Average over the warm runs, unless there are none
+    warm_imports = imports[1:] or imports
+    totals = {}
+    for modules in warm_imports:
+        for module, (self_us, cumulative_us) in modules.items():
+            old = totals.get(module, (0, 0))
+            totals[module] = (old[0] + self_us, old[1] + cumulative_us)
+    heaviest = sorted(totals.items(), key=lambda item: -item[1][0])[:top]
+
+    warm = timings[1:] or timings
+    return {
+        'command': cmd,
+        'python': python,
+        'runs': len(timings),
+        'returncode': returncode,
+        'timed_out': timed_out,
+        'cold': timings[0] if timings else None,
+        'warm': {
+            'p50': percentile(warm, 50),
+            'p90': percentile(warm, 90),
+            'max': max(warm),
+        } if warm else None,
+        'imports': [{
+            'module': module,
+            'self': self_us / 1e6 / len(warm_imports),
+            'cumulative': cumulative_us / 1e6 / len(warm_imports),
+        } for module, (self_us, cumulative_us) in heaviest],
+    }
+
+
 python_semver_regex = re.compile(r'^Python (\d)\.(\d+)\.(\d+)')
 
 
@@ -186,6 +1179,21 @@ code_for_get_real_python = (
 )
 
 
+def get_venv_command(python, python_semver, venv_path,
+                     system_site_packages=False):
+    # Install virtualenv, use the pipsi used python version by default
+    args = [sys.executable, '-m', 'virtualenv', '-p', python, venv_path]
+
+    if python_semver[0] == 3:
+        # if target python is 3, use its builtin `venv` module to create virtualenv
+        real_python = get_real_python(python)
+        args = [real_python, '-m', 'venv', venv_path]
+
+    if system_site_packages:
+        args.append('--system-site-packages')
+    return args
+
+
 # `venv` for python 3 has the problem that `venv` cannot
 # add pip in virtualenv if it is executed under a virtualenv,
 # use this function to avoid this problem
@@ -276,35 +1284,144 @@ class Repo(object):
         # No script metadata - fall back to older method of searching for executables
         return self.find_installed_executables(path)
 
-    def link_scripts(self, scripts):
+    def get_link_owner(self, path):
+        """The venv the script link `path` points into.
+
+        Returns None if `path` can be freely replaced, because it does not
+        exist or is a dangling link, and an empty string if it is not
+        managed by pipsi.
+        """
+        if not os.path.lexists(path):
+            return None
+        try:
+            target = normpath(join(dirname(path), os.readlink(path)))
+        except (OSError, AttributeError):
+            return ''
+        if not os.path.exists(target):
+            return None
+        prefix = join(self.home, '')
+        if not target.startswith(prefix):
+            return ''
+        return target[len(prefix):].split(os.sep, 1)[0]
+
+    def link_scripts(self, scripts, remove=()):
+        """Links `scripts` into the bin dir as one batch.
+
+        All links are created under temporary names first and then moved
+        into place with `replace_file`, so that scripts never disappear from
+        PATH while they are updated.  Afterwards the links in `remove`
+        that were not replaced are deleted.  Collisions with scripts that
+        do not belong to the package and failures are reported.
+
+        Returns the ``(script, link)`` pairs that are in place.
+        """
+        prefix = join(self.home, '')
         rv = []
+        pending = []
         for script in scripts:
             script_dst = os.path.join(
                 self.bin_dir, os.path.basename(script))
-            if publish_script(script, script_dst):
-                rv.append((script, script_dst))
+            if not IS_WIN:
+                if real_readlink(script_dst) == normalize(script):
+                    rv.append((script, script_dst))
+                    continue
+                venv = None
+                if normalize(script).startswith(prefix):
+                    venv = normalize(script)[len(prefix):].split(os.sep, 1)[0]
+                owner = self.get_link_owner(script_dst)
+                if owner is not None and owner != venv:
+                    click.echo('  Not replacing %s, it %s' % (
+                        script_dst, 'belongs to %s' % owner if owner
+                        else 'is not managed by pipsi'), err=True)
+                    continue
+            try:
+                pending.append((script, script_dst,
+                                prepare_script(script, script_dst)))
+            except (OSError, IOError) as e:
+                click.echo('  Could not link %s: %s' % (script_dst, e),
+                           err=True)
 
+        for script, script_dst, tmp in pending:
+            try:
+                replace_file(tmp, script_dst)
+            except (OSError, IOError) as e:
+                click.echo('  Could not link %s: %s' % (script_dst, e),
+                           err=True)
+                remove_path(tmp)
+                continue
+            if IS_WIN:
+                click.echo('  Copied Executable ' + script_dst)
+            else:
+                click.echo('  Linked script ' + script_dst)
+            rv.append((script, script_dst))
+
+        linked = set(script_dst for script, script_dst in rv)
+        for script_dst in sorted(set(remove) - linked):
+            click.echo('  Removing old script %s' % script_dst)
+            if not remove_path(script_dst):
+                click.echo('  Could not remove %s' % script_dst, err=True)
         return rv
 
-    def save_package_info(self, venv_path, package, scripts):
-        package_info_file_path = join(venv_path, 'package_info.json')
+    def save_package_info(self, venv_path, package, scripts, **extra):
         package_name = Requirement.parse(package).project_name
         version = extract_package_version(venv_path, package_name)
 
-        package_info = {
+        # Keep what other commands recorded
+        package_info = self.get_package_info(venv_path)
+        package_info.update(extra)
+        package_info.update({
             'name': package_name,
             'version': version,
             'scripts': [script for target, script in scripts],
-        }
-        with open(package_info_file_path, 'w') as fh:
-            json.dump(package_info, fh)
+            'entry_points': extract_entry_points(venv_path, package_name),
+            'entry_points_mtime': get_mtime(
+                find_entry_points_file(venv_path, package_name)[0]),
+        })
+        self.write_package_info(venv_path, package_info)
 
     def get_package_info(self, venv_path):
         package_info_file_path = join(venv_path, 'package_info.json')
-        with open(package_info_file_path, 'r') as fh:
-            return json.load(fh)
+        try:
+            with open(package_info_file_path, 'r') as fh:
+                return json.load(fh)
+        except (OSError, IOError):
+            # Installed with an older version of pipsi
+            return {}
+
+    def write_package_info(self, venv_path, package_info):
+        package_info_file_path = join(venv_path, 'package_info.json')
+        with open(package_info_file_path, 'w') as fh:
+            json.dump(package_info, fh)
+
+    def backfill_versions(self, packages):
+        """Fill in missing versions of `packages`, a list of
+        ``(venv_path, info)`` tuples, in place.
 
-    def install(self, package, python=None, editable=False, system_site_packages=False):
+        Each venv lacking a version is probed once, concurrently, and the
+        result is written back to its `package_info.json` so the cost is
+        only paid once.
+        """
+        missing = [(venv_path, info) for venv_path, info in packages
+                   if not info.get('version')]
+
+        def probe(item):
+            venv_path, info = item
+            name = info.get('name') or os.path.basename(venv_path)
+            return extract_package_version(venv_path, name)
+
+        for (venv_path, info), version in zip(missing,
+                                              parallel_map(probe, missing)):
+            if not version:
+                continue
+            # Venvs without metadata are left alone, writing a partial
+            # `package_info.json` would hide their installed scripts
+            had_info = bool(info)
+            info['version'] = version
+            if had_info:
+                self.write_package_info(venv_path, info)
+
+    def install(self, package, python=None, editable=False, system_site_packages=False,
+                shared_packages=None):
         # `python` could be int as major version, or str as absolute bin path,
         # if it's int, then we will try to find the executable `python2` or `python3` in PATH
         if isinstance(python, int):
@@ -319,10 +1436,40 @@ class Repo(object):
 
         package, install_args = self.resolve_package(package, python)
 
+        with self.lock(package):
+            return self._install(package, install_args, python, python_semver,
+                                 editable, system_site_packages,
+                                 shared_packages)
+
+    def _install(self, package, install_args, python, python_semver,
+                 editable, system_site_packages, shared_packages):
         venv_path = self.get_package_path(package)
-        if os.path.isdir(venv_path):
+        # Only an install with the same options can pick up the work
+        arguments = {
+            'python': python,
+            'editable': editable,
+            'system_site_packages': system_site_packages,
+            'shared_packages': sorted(shared_packages or []),
+            'install_args': install_args,
+        }
+        journal = self.get_journal(venv_path)
+        if journal is not None and journal['operation'] == 'install' and \
+           journal.get('arguments') != arguments:
+            click.echo('Restarting the interrupted install of %s, it was '
+                       'started with other options' % package)
+            shutil.rmtree(venv_path)
+            journal = None
+        if journal is not None and journal['operation'] == 'install':
+            click.echo('Resuming the interrupted install of %s' % package)
+        elif os.path.isdir(venv_path):
             click.echo('%s is already installed' % package)
             return
+        else:
+            os.makedirs(venv_path)
+            journal = {'operation': 'install', 'phases': [],
+                       'arguments': arguments}
+            self.write_journal(venv_path, journal)
+        phases = journal['phases']
 
         if not os.path.exists(self.bin_dir):
             os.makedirs(self.bin_dir)
@@ -336,108 +1483,970 @@ class Repo(object):
                 pass
             return False
 
-        # Install virtualenv, use the pipsi used python version by default
-        args = [sys.executable, '-m', 'virtualenv', '-p', python, venv_path]
-
-        if python_semver[0] == 3:
-            # if target python is 3, use its builtin `venv` module to create virtualenv
-            real_python = get_real_python(python)
-            args = [real_python, '-m', 'venv', venv_path]
-
-        if system_site_packages:
-            args.append('--system-site-packages')
+        def _done(phase):
+            phases.append(phase)
+            self.write_journal(venv_path, journal)
 
-        try:
+        if 'venv_created' not in phases:
+            args = get_venv_command(python, python_semver, venv_path,
+                                    system_site_packages)
             debugp('Popen: {}'.format(args))
             if Popen(args).wait() != 0:
                 click.echo('Failed to create virtualenv.  Aborting.')
                 return _cleanup()
 
+            journal['shared'] = None
+            if shared_packages:
+                journal['shared'] = self.ensure_shared_layer(
+                    python, python_semver, shared_packages)
+                if journal['shared'] is None:
+                    click.echo('Continuing without the shared layer.')
+                else:
+                    link_shared_layer(venv_path, journal['shared'])
+            _done('venv_created')
+
+        if 'deps_installed' not in phases:
             args = [os.path.join(venv_path, BIN_DIR, 'python'), '-m', 'pip', 'install']
             if editable:
                 args.append('--editable')
 
             debugp('Popen: {}'.format(args + install_args))
             if Popen(args + install_args).wait() != 0:
+                # Keep the venv, the next attempt resumes from here
                 click.echo('Failed to pip install.  Aborting.')
-                return _cleanup()
-        except Exception:
-            _cleanup()
-            raise
+                return False
+            _done('deps_installed')
 
-        # Find all the scripts
-        scripts = find_scripts(venv_path, package)
+        if 'scripts_linked' not in phases:
+            # Find all the scripts
+            scripts = find_scripts(venv_path, package)
 
-        # And link them
-        linked_scripts = self.link_scripts(scripts)
+            # And link them
+            linked_scripts = self.link_scripts(scripts)
 
-        self.save_package_info(venv_path, package, linked_scripts)
+            # We did not link any, rollback.
+            if not scripts:
+                click.echo('Did not find any scripts.  Uninstalling.')
+                return _cleanup()
+            if not linked_scripts:
+                click.echo('All scripts collide with existing ones or could '
+                           'not be linked.  Uninstalling.')
+                return _cleanup()
+            journal['scripts'] = [script for target, script in linked_scripts]
+            _done('scripts_linked')
+        else:
+            linked_scripts = [(None, script) for script in journal['scripts']]
 
-        # We did not link any, rollback.
-        if not linked_scripts:
-            click.echo('Did not find any scripts.  Uninstalling.')
-            return _cleanup()
+        self.save_package_info(venv_path, package, linked_scripts,
+                               shared=journal.get('shared'))
+        self.clear_journal(venv_path)
         return True
 
+    def get_journal_path(self, venv_path):
+        return join(venv_path, JOURNAL_FILE)
+
+    def get_journal(self, venv_path):
+        """The journal of an interrupted install or upgrade of the venv,
+        None if there is none.
+        """
+        try:
+            with open(self.get_journal_path(venv_path)) as fh:
+                return json.load(fh)
+        except (OSError, IOError, ValueError):
+            return None
+
+    def write_journal(self, venv_path, journal):
+        write_json(self.get_journal_path(venv_path), journal)
+
+    def clear_journal(self, venv_path):
+        remove_path(self.get_journal_path(venv_path))
+
+    def list_interrupted(self):
+        """Returns ``(venv, journal)`` for the packages with an interrupted
+        install or upgrade.
+        """
+        rv = []
+        if os.path.isdir(self.home):
+            for venv in sorted(os.listdir(self.home)):
+                journal = self.get_journal(join(self.home, venv))
+                if journal is not None:
+                    rv.append((venv, journal))
+        return rv
+
+    def get_shared_layer_path(self, python_semver):
+        return join(self.home, '.shared', 'python%d.%d' % python_semver[:2])
+
+    def ensure_shared_layer(self, python, python_semver, packages):
+        """Creates the shared dependency layer of the interpreter, or adds
+        the `packages` it is missing, and returns its site-packages.
+
+        Returns None if the layer could not be set up.
+        """
+        layer_path = self.get_shared_layer_path(python_semver)
+        from subprocess import Popen
+
+        with self.lock('pipsi-shared-python%d.%d' % python_semver[:2]):
+            if not os.path.isdir(layer_path):
+                click.echo('Creating the shared layer in %s' % layer_path)
+                args = get_venv_command(python, python_semver, layer_path)
+                debugp('Popen: {}'.format(args))
+                if Popen(args).wait() != 0:
+                    click.echo('Failed to create the shared layer.')
+                    remove_path(layer_path)
+                    return None
+
+            info = self.get_package_info(layer_path)
+            installed = info.get('packages', [])
+            missing = [package for package in packages
+                       if normalize_package(package) not in
+                       set(map(normalize_package, installed))]
+            if missing:
+                args = [get_venv_python(layer_path), '-m', 'pip', 'install']
+                debugp('Popen: {}'.format(args + missing))
+                if Popen(args + missing).wait() != 0:
+                    click.echo('Failed to install the shared layer.')
+                    return None
+                info['packages'] = installed + missing
+                self.write_package_info(layer_path, info)
+
+        return find_site_packages(layer_path)
+
     def uninstall(self, package):
         path = self.get_package_path(package)
         if not os.path.isdir(path):
             return UninstallInfo(package, installed=False)
         paths = [path]
         paths.extend(self.get_package_scripts(path))
+        # Scripts linked by an interrupted install or upgrade
+        journal = self.get_journal(path) or {}
+        paths.extend(script for script in journal.get('scripts', [])
+                     if script not in paths)
         return UninstallInfo(package, paths)
 
     def upgrade(self, package, editable=False):
         package, install_args = self.resolve_package(package)
 
+        with self.lock(package):
+            return self._upgrade(package, install_args, editable)
+
+    def _upgrade(self, package, install_args, editable):
         venv_path = self.get_package_path(package)
         if not os.path.isdir(venv_path):
             click.echo('%s is not installed' % package)
             return
 
+        journal = self.get_journal(venv_path)
+        if journal is None:
+            journal = {'operation': 'upgrade', 'phases': []}
+            self.write_journal(venv_path, journal)
+        elif journal['operation'] == 'install':
+            click.echo('The install of %s was interrupted, run `pipsi '
+                       'install` again to resume it.' % package)
+            return
+        else:
+            click.echo('Resuming the interrupted upgrade of %s' % package)
+        phases = journal['phases']
+
         from subprocess import Popen
 
         old_scripts = set(self.get_package_scripts(venv_path))
+        info = self.get_package_info(venv_path)
+        injected = info.get('injected', {})
+        injected_scripts = set(info.get('injected_scripts', []))
 
-        args = [os.path.join(venv_path, BIN_DIR, 'python'), '-m', 'pip', 'install',
-                '--upgrade']
-        if editable:
-            args.append('--editable')
+        if 'deps_installed' not in phases:
+            args = [os.path.join(venv_path, BIN_DIR, 'python'), '-m', 'pip', 'install',
+                    '--upgrade']
+            if editable:
+                args.append('--editable')
 
-        if Popen(args + install_args).wait() != 0:
-            click.echo('Failed to upgrade through pip.  Aborting.')
-            return
+            # Keep what was injected in the venv, see `inject`
+            install_args = install_args + sorted(injected.values())
+            if Popen(args + install_args).wait() != 0:
+                click.echo('Failed to upgrade through pip.  Aborting.')
+                return
+            phases.append('deps_installed')
+            self.write_journal(venv_path, journal)
+
+        if 'scripts_linked' not in phases:
+            scripts = find_scripts(venv_path, package)
+            linked_scripts = self.link_scripts(
+                scripts, remove=old_scripts - injected_scripts)
+            journal['scripts'] = [script for target, script in linked_scripts]
+            phases.append('scripts_linked')
+            self.write_journal(venv_path, journal)
+        else:
+            linked_scripts = [(None, script) for script in journal['scripts']]
+
+        linked_scripts.extend((None, script) for script in sorted(
+            injected_scripts - set(script for target, script in linked_scripts)))
+        self.save_package_info(venv_path, package, linked_scripts)
+        self.clear_journal(venv_path)
+
+        return True
 
-        scripts = find_scripts(venv_path, package)
-        linked_scripts = self.link_scripts(scripts)
-        to_delete = old_scripts - set(script for target, script in linked_scripts)
+    def inject(self, package, requirements):
+        """Installs additional `requirements` into the venv of `package`
+        and links the scripts of the distributions that were added.
 
-        for script in to_delete:
+        The requirements are recorded in `package_info.json` so they are
+        kept on upgrades.
+        """
+        with self.lock(package):
+            venv_path = self.get_package_path(package)
+            if not os.path.isdir(venv_path):
+                click.echo('%s is not installed' % package)
+                return
+
+            resolved = [self.resolve_package(requirement)
+                        for requirement in requirements]
+            install_args = []
+            for name, args in resolved:
+                install_args.extend(args)
+
+            from subprocess import Popen
+
+            before = list_distributions(venv_path)
+            args = [get_venv_python(venv_path), '-m', 'pip', 'install']
+            debugp('Popen: {}'.format(args + install_args))
+            if Popen(args + install_args).wait() != 0:
+                click.echo('Failed to inject through pip.  Aborting.')
+                return
+
+            # Only the distributions that are new need to be looked at
+            scripts = []
+            for entry in sorted(list_distributions(venv_path) - before):
+                scripts.extend(find_scripts(venv_path,
+                                            distribution_name(entry)))
+            linked_scripts = [script for target, script
+                              in self.link_scripts(scripts)]
+
+            info = self.get_package_info(venv_path)
+            if 'scripts' not in info:
+                info['scripts'] = list(
+                    self.find_installed_executables(venv_path))
+            injected = info.setdefault('injected', {})
+            for name, args in resolved:
+                # Upgrades may run from another folder
+                requirement = args[0]
+                if os.path.isdir(requirement):
+                    requirement = os.path.abspath(requirement)
+                injected[normalize_package(name)] = requirement
+            for key in 'scripts', 'injected_scripts':
+                info[key] = info.get(key, []) + [
+                    script for script in linked_scripts
+                    if script not in info.get(key, [])]
+            self.write_package_info(venv_path, info)
+        return True
+
+    def relink(self, package):
+        """Brings the linked scripts of `package` in line with its
+        `console_scripts` entry points, without running pip.
+
+        The metadata of `.egg-link` development installs is regenerated
+        when the setup files of the project changed.  Returns the added
+        and removed script names, or None on failure.
+        """
+        with self.lock(package):
+            venv_path = self.get_package_path(package)
+            if not os.path.isdir(venv_path):
+                click.echo('%s is not installed' % package)
+                return
+
+            info = self.get_package_info(venv_path)
+            name = info.get('name') or package
+            path, project = find_entry_points_file(venv_path, name)
+            if project is not None and metadata_outdated(path, project):
+                click.echo('Regenerating the metadata of %s' % name)
+                r = run([get_venv_python(venv_path), 'setup.py', 'egg_info'],
+                        cwd=project)
+                if r.returncode != 0:
+                    click.echo('Failed to regenerate the metadata: %s'
+                               % r.stderr)
+                    return
+                path, project = find_entry_points_file(venv_path, name)
+            if path is None:
+                click.echo('Could not find the metadata of %s' % name)
+                return
+
+            mtime = get_mtime(path)
+            if 'entry_points' in info and \
+               info.get('entry_points_mtime') == mtime:
+                return [], []
+
+            entry_points = read_entry_points(path)
+            injected_scripts = set(info.get('injected_scripts', []))
+            old = info.get('entry_points')
+            if old is None:
+                old = dict((os.path.basename(script), None)
+                           for script in info.get('scripts', [])
+                           if script not in injected_scripts)
+
+            added = sorted(set(entry_points) - set(old))
+            removed = sorted(set(old) - set(entry_points))
+            changed = added + [script for script in entry_points
+                               if old.get(script) not in
+                               (None, entry_points[script])]
+
+            prefix = join(normalize(venv_path), '')
+            scripts = [script for script in info.get('scripts', [])
+                       if os.path.basename(script) not in removed or
+                       script in injected_scripts]
+            # Links of this venv are only removed along with the batch
+            remove = []
+            for script in removed:
+                dst = join(self.bin_dir, script)
+                target = real_readlink(dst)
+                if target is not None and \
+                   normalize(target).startswith(prefix):
+                    remove.append(dst)
+
+            if changed and IS_WIN:
+                click.echo('Scripts cannot be generated on windows, '
+                           'use `pipsi upgrade` instead.')
+                changed = []
+            for target, dst in self.link_scripts([
+                    write_script(venv_path, script, entry_points[script])
+                    for script in sorted(changed)], remove=remove):
+                if dst not in scripts:
+                    scripts.append(dst)
+            for script in removed:
+                remove_path(join(venv_path, BIN_DIR, script))
+
+            info.update({
+                'name': name,
+                'scripts': scripts,
+                'entry_points': entry_points,
+                'entry_points_mtime': mtime,
+            })
+            self.write_package_info(venv_path, info)
+        return added, removed
+
+    def outdated(self, index_url=DEFAULT_INDEX_URL, pre=False):
+        """Checks the index for newer releases of the installed packages.
+
+        Returns ``(outdated, errors)``, lists of `Outdated` and of
+        ``(name, error message)``.
+        """
+        packages = [(venv_path, self.get_package_info(venv_path))
+                    for venv, venv_path in self.iter_venvs()]
+        self.backfill_versions(packages)
+        client = IndexClient(index_url, join(self.home, '.cache', 'index'))
+
+        def check(item):
+            venv_path, info = item
+            name = info.get('name') or os.path.basename(venv_path)
             try:
-                click.echo('  Removing old script %s' % script)
-                os.remove(script)
-            except (IOError, OSError):
+                releases = client.get_versions(name)
+            except (OSError, IOError, ValueError,
+                    httplib.HTTPException) as e:
+                return name, None, str(e)
+            versions = []
+            for release in releases:
+                try:
+                    versions.append(parse_version(release))
+                except ValueError:
+                    pass
+            if not pre:
+                versions = [v for v in versions if not v.is_prerelease]
+            if not versions:
+                return name, None, 'not found on the index'
+            return name, max(versions), None
+
+        outdated = []
+        errors = []
+        for (venv_path, info), (name, latest, error) in zip(
+                packages, parallel_map(check, packages)):
+            if error is not None:
+                errors.append((name, error))
+                continue
+            installed = info.get('version')
+            if not installed or parse_version(installed) < latest:
+                outdated.append(Outdated(name, installed or None, str(latest)))
+        return outdated, errors
+
+    def find_script(self, name):
+        """Looks up the linked script `name`, returns ``(venv_path,
+        info, script)`` where `script` is the path inside the venv, None
+        if there is no such script.
+        """
+        for venv, venv_path in self.iter_venvs():
+            info = self.get_package_info(venv_path)
+            for link in info.get('scripts', []):
+                if os.path.basename(link) == name:
+                    script = real_readlink(link) or join(
+                        venv_path, BIN_DIR, name)
+                    return venv_path, info, script
+
+    def iter_scripts(self):
+        """Yields the names of all linked scripts."""
+        for venv, venv_path in self.iter_venvs():
+            for link in self.get_package_info(venv_path).get('scripts', []):
+                yield os.path.basename(link)
+
+    def profile(self, name, runs=10, args=('--help',), top=10, timeout=10):
+        """Measures the startup latency of the linked script `name`, see
+        `profile_script`.
+        """
+        if IS_WIN:
+            raise click.UsageError('Profiling is not supported on windows')
+        found = self.find_script(name)
+        if found is None:
+            raise click.UsageError('No script %s installed through pipsi'
+                                   % name)
+        venv_path, info, script = found
+        result = profile_script(venv_path, script, runs, args, top, timeout)
+        result.update({
+            'script': name,
+            'package': info.get('name') or os.path.basename(venv_path),
+            'version': info.get('version'),
+        })
+        return result
+
+    def get_cache_path(self, name):
+        return join(self.home, '.cache', name + '.json')
+
+    def load_cache(self, name):
+        try:
+            with open(self.get_cache_path(name), 'r') as fh:
+                return json.load(fh)
+        except (OSError, IOError, ValueError):
+            return {}
+
+    def save_cache(self, name, data):
+        write_json(self.get_cache_path(name), data)
+
+    def disk_usage(self):
+        """Measures the disk usage of every installed package.
+
+        Returns ``(usage, total)`` where `usage` is a list of
+        ``(venv, DiskUsage)`` tuples, which includes the shared layers as
+        ``.shared/<layer>``.  Every inode is counted once; bytes of files
+        that are hardlinked from another package, or from outside of the
+        home, are reported as shared.  Scan results are cached and reused
+        as long as no directory mtime changed.
+        """
+        venvs = list(self.iter_venvs()) + list(self.iter_shared_layers())
+        cache = self.load_cache('du')
+        changed = [len(cache) != len(venvs)]
+
+        def scan(item):
+            venv, venv_path = item
+            entry = cache.get(venv)
+            if entry is None or not tree_unchanged(venv_path, entry['dirs']):
+                dirs, files = scan_tree(venv_path)
+                entry = {'dirs': dirs, 'files': files}
+                changed[0] = True
+            return entry
+
+        entries = parallel_map(scan, venvs)
+        if changed[0]:
+            self.save_cache('du', dict(
+                (venv, entry) for (venv, venv_path), entry
+                in zip(venvs, entries)))
+
+        owners = {}
+        links = {}
+        inodes = {}
+        for (venv, venv_path), entry in zip(venvs, entries):
+            for dev, inode, nlink, size in entry['files']:
+                key = (dev, inode)
+                owners.setdefault(key, set()).add(venv)
+                links[key] = links.get(key, 0) + 1
+                inodes[key] = (nlink, size)
+
+        shared = set(key for key, (nlink, size) in inodes.items()
+                     if len(owners[key]) > 1 or nlink > links[key])
+
+        usage = []
+        for (venv, venv_path), entry in zip(venvs, entries):
+            unique_bytes = shared_bytes = 0
+            for key in set((dev, inode) for dev, inode, nlink, size
+                           in entry['files']):
+                if key in shared:
+                    shared_bytes += inodes[key][1]
+                else:
+                    unique_bytes += inodes[key][1]
+            usage.append((venv, DiskUsage(unique_bytes, shared_bytes)))
+
+        total = DiskUsage(
+            sum(size for key, (nlink, size) in inodes.items()
+                if key not in shared),
+            sum(inodes[key][1] for key in shared))
+        return usage, total
+
+    def get_lock_path(self, package):
+        return join(self.home, '.locks', normalize_package(package))
+
+    def get_lock_owner(self, package):
+        """The pid of the live process holding the lock of `package`,
+        None if it is not locked.
+        """
+        try:
+            with open(self.get_lock_path(package)) as fh:
+                pid = int(fh.read().strip() or 0)
+        except (OSError, IOError, ValueError):
+            return None
+        if pid and pid_alive(pid):
+            return pid
+
+    @contextmanager
+    def lock(self, package):
+        """Marks an operation on `package` as in progress, so that
+        concurrent pipsi processes (for instance `gc`) leave it alone.
+        """
+        path = self.get_lock_path(package)
+        if not os.path.isdir(dirname(path)):
+            try:
+                os.makedirs(dirname(path))
+            except OSError:
                 pass
+        for attempt in range(2):
+            try:
+                fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+                owner = self.get_lock_owner(package)
+                if owner is not None:
+                    raise click.UsageError(
+                        '%s is being modified by another pipsi process '
+                        '(pid %s).  Remove %s if that process is gone.'
+                        % (package, owner, path))
+                # Left behind by a process that died
+                remove_path(path)
+            else:
+                break
+        else:
+            raise click.UsageError('Could not lock %s' % package)
+        os.write(fd, str(os.getpid()).encode('ascii'))
+        os.close(fd)
+        try:
+            yield
+        finally:
+            remove_path(path)
 
-        self.save_package_info(venv_path, package, linked_scripts)
+    def find_links(self):
+        """Maps the links in the bin dir that point into the home to
+        their (not necessarily existing) targets.
+        """
+        prefix = join(self.home, '')
+        links = {}
+        try:
+            for filename in os.listdir(self.bin_dir):
+                exe = join(self.bin_dir, filename)
+                try:
+                    target = os.readlink(exe)
+                except (OSError, AttributeError):
+                    continue
+                target = normpath(join(self.bin_dir, target))
+                if target.startswith(prefix):
+                    links[exe] = target
+        except OSError:
+            pass
+        return links
+
+    def collect_garbage(self):
+        """Finds reclaimable files in the home and the bin dir in a single
+        parallel pass: orphaned venvs, bytecode of unused interpreters,
+        dangling script links, stale locks and caches.
+
+        Packages with an operation in progress are skipped.
+        """
+        prefix = join(self.home, '')
+        links = self.find_links()
+        linked_venvs = set(target[len(prefix):].split(os.sep, 1)[0]
+                           for target in links.values())
+        venvs = []
+        if os.path.isdir(self.home):
+            venvs = [venv for venv in sorted(os.listdir(self.home))
+                     if not venv.startswith('.') and
+                     os.path.isdir(join(self.home, venv))]
+
+        def scan(venv):
+            if self.get_lock_owner(venv) is not None:
+                return []
+            venv_path = join(self.home, venv)
+            journal = self.get_journal(venv_path) or {}
+            if journal.get('operation') == 'install' or \
+               not os.path.isfile(join(venv_path, 'package_info.json')) \
+               and venv not in linked_venvs:
+                dirs, files = scan_tree(venv_path)
+                return [Garbage('orphaned venv', venv_path,
+                                sum(f[3] for f in files))]
+            return list(find_stale_bytecode(venv_path))
+
+        items = []
+        for garbage in parallel_map(scan, venvs):
+            items.extend(garbage)
+
+        for exe, target in sorted(links.items()):
+            match = re.search(r'\.(\d+)\.pipsi-tmp$', exe)
+            if match is not None and not pid_alive(int(match.group(1))):
+                # Left behind by an interrupted `link_scripts`
+                items.append(Garbage('dangling link', exe, 0))
+                continue
+            venv = target[len(prefix):].split(os.sep, 1)[0]
+            if not os.path.lexists(target) and \
+               self.get_lock_owner(venv) is None:
+                items.append(Garbage('dangling link', exe, 0))
+
+        locks_dir = join(self.home, '.locks')
+        if os.path.isdir(locks_dir):
+            for name in sorted(os.listdir(locks_dir)):
+                if self.get_lock_owner(name) is None:
+                    items.append(Garbage('stale lock', join(locks_dir, name), 0))
+
+        cache = self.load_cache('du')
+        if any(not os.path.isdir(join(self.home, venv)) for venv in cache):
+            path = self.get_cache_path('du')
+            items.append(Garbage('stale cache', path, os.path.getsize(path)))
+
+        return GarbageInfo(self, items)
+
+    def export(self, fileobj, mode='w|gz'):
+        """Streams all installed packages and their links in the bin dir
+        into a tar archive written to `fileobj`.
+        """
+        packages = [venv for venv, venv_path in self.iter_venvs()]
+        prefix = join(self.home, '')
+        links = {}
+        for exe, target in self.find_links().items():
+            target = target[len(prefix):]
+            if target.split(os.sep, 1)[0] in packages:
+                links[os.path.basename(exe)] = target.replace(os.sep, '/')
+
+        shared_dir = join(self.home, '.shared')
+        shared = []
+        if os.path.isdir(shared_dir):
+            shared = sorted(os.listdir(shared_dir))
+
+        manifest = json.dumps({
+            'home': self.home,
+            'bin_dir': os.path.abspath(self.bin_dir),
+            'packages': packages,
+            'shared': shared,
+            'links': links,
+        }).encode('utf-8')
+
+        with tarfile.open(fileobj=fileobj, mode=mode) as tar:
+            info = tarfile.TarInfo(ARCHIVE_MANIFEST)
+            info.size = len(manifest)
+            info.mtime = time.time()
+            tar.addfile(info, BytesIO(manifest))
+            for layer in shared:
+                tar.add(join(shared_dir, layer), arcname='.shared/' + layer)
+            for venv in packages:
+                tar.add(join(self.home, venv), arcname=venv)
+        return packages
+
+    def import_(self, fileobj):
+        """Unpacks an archive written by `export` into the home and links
+        its scripts into the bin dir, relocating the venvs on the fly.
+        """
+        with tarfile.open(fileobj=fileobj, mode='r|*') as tar:
+            members = iter(tar)
+            member = next(members, None)
+            if member is None or member.name != ARCHIVE_MANIFEST:
+                raise click.UsageError('Not an archive exported by pipsi')
+            manifest = json.loads(
+                tar.extractfile(member).read().decode('utf-8'))
+
+            packages = manifest['packages']
+            for venv in packages:
+                if os.path.exists(join(self.home, venv)):
+                    raise click.UsageError('%s is already installed' % venv)
+            # Shared layers already present here are kept as they are
+            shared = [layer for layer in manifest.get('shared', [])
+                      if not os.path.exists(join(self.home, '.shared', layer))]
+
+            replacements = sorted([
+                (manifest['home'], self.home),
+                (manifest['bin_dir'], os.path.abspath(self.bin_dir)),
+            ], key=lambda item: -len(item[0]))
+
+            def refuse(member):
+                raise click.UsageError('Refusing to extract %s' % member.name)
+
+            def check_parents(member, name):
+                # Everything in the staging folder is created by this
+                # import, a symlinked folder must not be written through
+                parts = name.split('/')
+                for i in range(1, len(parts)):
+                    if os.path.islink(join(staging, *parts[:i])):
+                        refuse(member)
+
+            # Extract next to the venvs and move each into place once it
+            # is complete, so a failure leaves nothing half unpacked
+            if not os.path.isdir(self.home):
+                os.makedirs(self.home)
+            staging = tempfile.mkdtemp(prefix='.pipsi-import-', dir=self.home)
+            moved = []
+            try:
+                dirs = []
+                for member in members:
+                    name = normpath(member.name).replace(os.sep, '/')
+                    if os.path.isabs(name) or name.split('/')[0] == '..':
+                        refuse(member)
+                    venv, _, rest = name.partition('/')
+                    root = venv
+                    if venv == '.shared':
+                        layer, _, rest = rest.partition('/')
+                        if layer not in manifest.get('shared', []):
+                            refuse(member)
+                        if layer not in shared:
+                            continue
+                        root = '.shared/' + layer
+                    elif venv not in packages:
+                        refuse(member)
+                    check_parents(member, name)
+                    path = join(staging, *name.split('/'))
+
+                    if member.isdir():
+                        if not os.path.isdir(path):
+                            os.makedirs(path)
+                        dirs.append((path, member))
+                        continue
+                    if not os.path.isdir(dirname(path)):
+                        os.makedirs(dirname(path))
+                    if os.path.lexists(path):
+                        # Later members replace earlier ones, never write
+                        # through what an earlier one left there
+                        os.remove(path)
+                    if member.issym():
+                        os.symlink(relocate_path(member.linkname,
+                                                 replacements), path)
+                        continue
+                    if member.islnk():
+                        target = normpath(member.linkname).replace(
+                            os.sep, '/')
+                        if os.path.isabs(target) or \
+                           not target.startswith(root + '/'):
+                            refuse(member)
+                        check_parents(member, target)
+                        os.link(join(staging, *target.split('/')), path)
+                        continue
+                    if not member.isfile():
+                        continue
+
+                    data = relocate_file(
+                        rest, tar.extractfile(member).read(), replacements)
+                    flags = os.O_WRONLY | os.O_CREAT | os.O_EXCL | \
+                        getattr(os, 'O_NOFOLLOW', 0) | \
+                        getattr(os, 'O_BINARY', 0)
+                    with os.fdopen(os.open(path, flags, 0o600),
+                                   'wb') as fh:
+                        fh.write(data)
+                    os.chmod(path, member.mode)
+                    # Keep mtimes so that the bytecode stays valid
+                    os.utime(path, (member.mtime, member.mtime))
+
+                for path, member in reversed(dirs):
+                    os.chmod(path, member.mode)
+                    os.utime(path, (member.mtime, member.mtime))
+
+                roots = packages + ['.shared/' + layer for layer in shared]
+                for root in roots:
+                    src = join(staging, *root.split('/'))
+                    dst = join(self.home, *root.split('/'))
+                    if not os.path.isdir(src):
+                        continue
+                    if not os.path.isdir(dirname(dst)):
+                        os.makedirs(dirname(dst))
+                    if os.path.exists(dst):
+                        raise click.UsageError('%s is already installed'
+                                               % root)
+                    os.rename(src, dst)
+                    moved.append(dst)
+            except BaseException:
+                for path in moved:
+                    remove_path(path)
+                raise
+            finally:
+                shutil.rmtree(staging, True)
+
+        if not os.path.exists(self.bin_dir):
+            os.makedirs(self.bin_dir)
+        self.link_scripts([join(self.home, *target.split('/'))
+                           for name, target in sorted(manifest['links'].items())])
+        return packages
+
+    def get_entry_points(self, venv_path):
+        """The entry points recorded in `package_info.json`, probed and
+        recorded first for packages installed by older versions of pipsi.
+        """
+        info = self.get_package_info(venv_path)
+        if 'entry_points' not in info:
+            entry_points = extract_entry_points(
+                venv_path, info.get('name') or os.path.basename(venv_path))
+            if not info:
+                return entry_points
+            info['entry_points'] = entry_points
+            self.write_package_info(venv_path, info)
+        return info['entry_points']
+
+    def pack(self, package, output, entry_point=None, python=None,
+             extract_native=False, compress=False):
+        """Builds an executable zipapp of the installed `package` and its
+        dependencies at `output`.
+
+        Modules are precompiled with the venv's interpreter and stored
+        uncompressed by default so they import quickly.  Packages with
+        native extensions are refused unless `extract_native` is set, in
+        which case the zipapp unpacks itself into a cache folder.
+        """
+        venv_path = self.get_package_path(package)
+        if not os.path.isdir(venv_path):
+            click.echo('%s is not installed' % package)
+            return
+
+        entry_points = self.get_entry_points(venv_path)
+        if not entry_points:
+            raise click.UsageError('%s has no console scripts' % package)
+        if entry_point is None:
+            entry_point = normalize_package(package)
+            if entry_point not in entry_points:
+                entry_point = sorted(entry_points)[0]
+        elif entry_point not in entry_points:
+            raise click.UsageError('%s has no console script %s' % (
+                package, entry_point))
+
+        site_packages = find_site_packages(venv_path)
+        if site_packages is None:
+            raise click.UsageError('Could not find the site-packages of %s'
+                                   % package)
+        files, native = collect_pack_files(site_packages)
+        sources = dict((name, site_packages) for name in files)
+
+        # Dependencies of the shared layer go along, unless the venv has
+        # its own version of them
+        shared = self.get_package_info(venv_path).get('shared')
+        if shared:
+            if not os.path.isdir(shared):
+                raise click.UsageError('The shared layer %s of %s is missing'
+                                       % (shared, package))
+            own = set(map(get_pack_top_level, files))
+            shared_files, shared_native = collect_pack_files(shared)
+            shared_files = [name for name in shared_files
+                            if get_pack_top_level(name) not in own]
+            sources.update((name, shared) for name in shared_files)
+            native = sorted(native + [name for name in shared_native
+                                      if sources.get(name) == shared])
+            files = sorted(sources)
+
+        if native and not extract_native:
+            raise click.UsageError(
+                '%s contains native extensions (%s) which cannot be imported '
+                'from a zipapp.  Use --extract-native to unpack them into a '
+                'cache folder at runtime.' % (package, ', '.join(native[:3])))
+
+        if python is None:
+            match = re.match(r'\d+\.\d+', read_pyvenv_cfg(venv_path).get(
+                'version') or '')
+            python = '/usr/bin/env python' + (match.group(0) if match else '')
+
+        main = ZIPAPP_MAIN_TEMPLATE \
+            .replace('__ENTRY_POINTS__', repr(entry_points)) \
+            .replace('__DEFAULT_ENTRY_POINT__', repr(entry_point)) \
+            .replace('__EXTRACT__', repr(bool(native)))
 
+        build_dir = tempfile.mkdtemp(prefix='pipsi-pack-')
+        try:
+            for name in files:
+                dst = join(build_dir, name)
+                if not os.path.isdir(dirname(dst)):
+                    os.makedirs(dirname(dst))
+                shutil.copy2(join(sources[name], name), dst)
+            with open(join(build_dir, '__main__.py'), 'w') as fh:
+                fh.write(main)
+
+            # Bytecode next to the sources, where zipimport looks for it
+            if run([get_venv_python(venv_path), '-c',
+                    code_for_compile_legacy, build_dir]).returncode != 0:
+                click.echo('Failed to compile bytecode.  Aborting.')
+                return
+
+            compiled = [name[:-3] + '.pyc' for name in files
+                        if name.endswith('.py')]
+            members = ['__main__.py', '__main__.pyc'] + sorted(
+                [name for name in files + compiled
+                 if os.path.isfile(join(build_dir, name))])
+
+            tmp_output = '%s.%d.tmp' % (output, os.getpid())
+            with open(tmp_output, 'wb') as fh:
+                fh.write(('#!%s\n' % python).encode('utf-8'))
+                with zipfile.ZipFile(
+                        fh, 'w', zipfile.ZIP_DEFLATED if compress
+                        else zipfile.ZIP_STORED) as zf:
+                    for name in members:
+                        zf.write(join(build_dir, name),
+                                 name.replace(os.sep, '/'))
+            os.chmod(tmp_output, 0o755)
+            replace_file(tmp_output, output)
+        finally:
+            shutil.rmtree(build_dir, True)
         return True
 
-    def list_everything(self, versions=False):
-        venvs = {}
-        python = '/Scripts/python.exe' if IS_WIN else '/bin/python'
+    def iter_venvs(self):
+        """Yields ``(venv, venv_path)`` for every virtualenv in the home,
+        leaving out interrupted installs.
+        """
         if os.path.isdir(self.home):
-            for venv in os.listdir(self.home):
+            for venv in sorted(os.listdir(self.home)):
                 venv_path = os.path.join(self.home, venv)
                 if os.path.isdir(venv_path) and \
-                   os.path.isfile(venv_path + python):
-                    info = self.get_package_info(venv_path)
-                    version = None
-                    if versions:
-                        version = info.get('version')
-                    venvs[venv] = [info.get('scripts', []), version]
+                   os.path.isfile(get_venv_python(venv_path)) and \
+                   (self.get_journal(venv_path) or {}).get(
+                       'operation') != 'install':
+                    yield venv, venv_path
+
+    def iter_shared_layers(self):
+        """Yields ``('.shared/<layer>', path)`` for every shared layer."""
+        shared = join(self.home, '.shared')
+        if os.path.isdir(shared):
+            for layer in sorted(os.listdir(shared)):
+                if os.path.isdir(join(shared, layer)):
+                    yield '.shared/' + layer, join(shared, layer)
+
+    def list_everything(self, versions=False):
+        packages = [(venv_path, self.get_package_info(venv_path))
+                    for venv, venv_path in self.iter_venvs()]
+        if versions:
+            self.backfill_versions(packages)
+
+        venvs = []
+        for venv_path, info in packages:
+            version = info.get('version') if versions else None
+            venvs.append((os.path.basename(venv_path),
+                          [info.get('scripts', []), version]))
+        return venvs
+
+    def list_details(self):
+        """Returns a machine readable description of every installed
+        package, with missing versions backfilled.
+        """
+        packages = [(venv_path, self.get_package_info(venv_path))
+                    for venv, venv_path in self.iter_venvs()]
+        self.backfill_versions(packages)
 
-        return sorted(venvs.items())
+        usage = dict(self.disk_usage()[0])
+        rv = []
+        for venv_path, info in packages:
+            venv = os.path.basename(venv_path)
+            cfg = read_pyvenv_cfg(venv_path)
+            rv.append({
+                'name': info.get('name') or venv,
+                'version': info.get('version') or None,
+                'interpreter': realpath(get_venv_python(venv_path)),
+                'python_version': cfg.get('version') or
+                cfg.get('version_info') or None,
+                'scripts': info.get('scripts', []),
+                'path': venv_path,
+                'size': sum(usage[venv]),
+                'interrupted': (self.get_journal(venv_path) or {}).get(
+                    'operation'),
+            })
+        return rv
 
 
 @click.group(context_settings=CONTEXT_SETTINGS)
@@ -474,8 +2483,16 @@ def cli(ctx, home, bin_dir):
 @click.option('--system-site-packages', is_flag=True,
               help='Give the virtual environment access to the global '
                    'site-packages.')
+@click.option('--shared', is_flag=True, envvar='PIPSI_SHARED',
+              help='Take common dependencies from a layer that is installed '
+                   'once per interpreter and shared by all virtualenvs.  '
+                   'Conflicting versions are still installed locally.')
+@click.option('--shared-packages', envvar='PIPSI_SHARED_PACKAGES',
+              default=','.join(SHARED_PACKAGES), show_default=True,
+              help='Comma separated packages of the shared layer.')
 @click.pass_obj
-def install(repo, package, python, editable, system_site_packages):
+def install(repo, package, python, editable, system_site_packages, shared,
+            shared_packages):
     """Installs scripts from a Python package.
 
     Given a package this will install all the scripts and their dependencies
@@ -484,7 +2501,13 @@ def install(repo, package, python, editable, system_site_packages):
     """
     if re.search(r'^\d$', python):
         python = int(python)
-    if repo.install(package, python, editable, system_site_packages):
+    if shared:
+        shared_packages = [p.strip() for p in shared_packages.split(',')
+                           if p.strip()]
+    else:
+        shared_packages = None
+    if repo.install(package, python, editable, system_site_packages,
+                    shared_packages):
         click.echo('Done.')
     else:
         sys.exit(1)
@@ -531,24 +2554,300 @@ def uninstall(repo, package, yes):
 @cli.command('list')
 @click.option('--versions', is_flag=True,
               help='Show packages version')
+@click.option('--format', 'fmt', type=click.Choice(['text', 'json']),
+              default='text', help='The output format.')
+@click.option('--json', 'as_json', is_flag=True,
+              help='Shortcut for --format=json.')
 @click.pass_obj
-def list_cmd(repo, versions):
+def list_cmd(repo, versions, fmt, as_json):
     """Lists all scripts installed through pipsi."""
-    list_of_non_empty_venv = [(venv, scripts)
-                              for venv, scripts in repo.list_everything()
-                              if scripts]
-    if list_of_non_empty_venv:
+    if as_json or fmt == 'json':
+        click.echo(json.dumps(repo.list_details(), indent=2, sort_keys=True))
+        return
+
+    venvs = repo.list_everything(versions)
+    if venvs:
         click.echo('Packages and scripts installed through pipsi:')
-        for venv, (scripts, version) in repo.list_everything(versions):
+        for venv, (scripts, version) in venvs:
             if versions:
                 click.echo('  Package "%s" (%s):' % (venv, version or 'unknown'))
             else:
                 click.echo('  Package "%s":' % venv)
-                for script in scripts:
-                    click.echo('    ' + script)
+            for script in scripts:
+                click.echo('    ' + script)
     else:
         click.echo('There are no scripts installed through pipsi')
 
+    interrupted = repo.list_interrupted()
+    if interrupted:
+        click.echo('Interrupted operations, run them again to resume:')
+        for venv, journal in interrupted:
+            click.echo('  Package "%s": %s (done: %s)' % (
+                venv, journal['operation'],
+                ', '.join(journal['phases']) or 'nothing'))
+
+
+@cli.command('du')
+@click.option('--json', 'as_json', is_flag=True, help='Output as JSON.')
+@click.pass_obj
+def du_cmd(repo, as_json):
+    """Shows the disk usage of the installed packages.
+
+    Hardlinked files are counted once.  Bytes shared with other packages
+    (or with hardlinks outside of the home) are reported separately.
+    """
+    usage, total = repo.disk_usage()
+    if as_json:
+        def describe(du):
+            return {'unique': du.unique, 'shared': du.shared,
+                    'size': sum(du)}
+        click.echo(json.dumps({
+            'packages': dict((venv, describe(du)) for venv, du in usage),
+            'total': describe(total),
+        }, indent=2, sort_keys=True))
+        return
+
+    for venv, du in usage:
+        click.echo('  %-30s %8s (%s shared)' % (
+            venv, format_size(sum(du)), format_size(du.shared)))
+    click.echo('Total: %s (%s shared)' % (
+        format_size(sum(total)), format_size(total.shared)))
+
+
+@cli.command(short_help='Removes files that are no longer needed.')
+@click.option('--dry-run', '-n', is_flag=True,
+              help='Only show what would be removed.')
+@click.option('--yes', is_flag=True, help='Skips all prompts.')
+@click.pass_obj
+def gc(repo, dry_run, yes):
+    """Removes orphaned virtualenvs (such as left behind by failed
+    installs), bytecode compiled for interpreters no longer in use,
+    dangling links in BIN_DIR and stale locks and caches.
+    """
+    ginfo = repo.collect_garbage()
+    if not ginfo.items:
+        click.echo('Nothing to clean up')
+        return
+    click.echo('The following paths can be removed:')
+    for item in ginfo.items:
+        click.echo('  [%s] %s (%s)' % (
+            item.kind, click.format_filename(item.path),
+            format_size(item.size)))
+    click.echo('Reclaimable: %s' % format_size(ginfo.size))
+    if dry_run:
+        return
+    click.echo()
+    if yes or click.confirm('Do you want to remove them?'):
+        failed = ginfo.perform()
+        for item in failed:
+            click.echo('Could not remove %s' % item.path, err=True)
+        click.echo('Done!')
+        if failed:
+            sys.exit(1)
+    else:
+        click.echo('Aborted!')
+        sys.exit(1)
+
+
+@cli.command()
+@click.argument('package')
+@click.argument('requirements', nargs=-1, required=True)
+@click.pass_obj
+def inject(repo, package, requirements):
+    """Installs additional requirements, such as plugins, into the
+    virtualenv of an installed package.
+
+    The scripts of newly added distributions are linked and the
+    requirements are kept when the package is upgraded.
+    """
+    if repo.inject(package, list(requirements)):
+        click.echo('Done.')
+    else:
+        sys.exit(1)
+
+
+@cli.command()
+@click.argument('package', required=False)
+@click.option('--all', 'all_', is_flag=True,
+              help='Relink the scripts of all installed packages.')
+@click.pass_obj
+def relink(repo, package, all_):
+    """Re-syncs the scripts of a package with its entry points.
+
+    This is meant for editable installs after console scripts were added
+    or removed in the source tree.  Unlike `pipsi upgrade` it does not
+    run pip and only touches the scripts that changed.
+    """
+    if bool(package) == all_:
+        raise click.UsageError('Pass either a package or --all.')
+    if all_:
+        packages = [venv for venv, venv_path in repo.iter_venvs()]
+    else:
+        packages = [package]
+    failed = False
+    for package in packages:
+        if repo.relink(package) is None:
+            failed = True
+    if failed:
+        sys.exit(1)
+    click.echo('Done.')
+
+
+@cli.command()
+@click.option('--index-url', envvar=['PIPSI_INDEX_URL', 'PIP_INDEX_URL'],
+              default=DEFAULT_INDEX_URL, show_default=True,
+              help='The PEP 503 simple index to check, can be a file:// '
+                   'url of a local index or folder of wheels.')
+@click.option('--pre', is_flag=True,
+              help='Include pre-release and development versions.')
+@click.option('--json', 'as_json', is_flag=True, help='Output as JSON.')
+@click.pass_obj
+def outdated(repo, index_url, pre, as_json):
+    """Lists the installed packages that have newer releases."""
+    packages, errors = repo.outdated(index_url, pre)
+    for name, error in errors:
+        click.echo('Could not check %s: %s' % (name, error), err=True)
+    if as_json:
+        click.echo(json.dumps([dict(p._asdict()) for p in packages],
+                              indent=2, sort_keys=True))
+    elif packages:
+        click.echo('Packages with newer releases:')
+        for package in packages:
+            click.echo('  Package "%s": %s -> %s' % (
+                package.name, package.installed or 'unknown', package.latest))
+    else:
+        click.echo('All packages are up to date')
+    if errors:
+        sys.exit(1)
+
+
+def format_duration(seconds):
+    return '%.1fms' % (seconds * 1000)
+
+
+@cli.command()
+@click.argument('script', required=False)
+@click.option('--all', 'all_', is_flag=True,
+              help='Profile every script installed through pipsi.')
+@click.option('--runs', '-n', type=click.IntRange(1, None), default=10,
+              show_default=True, help='How often to run each script.')
+@click.option('--args', 'script_args', default='--help', show_default=True,
+              help='The arguments to run the scripts with.')
+@click.option('--top', type=click.IntRange(0, None), default=10,
+              show_default=True, help='How many of the heaviest imports '
+              'to show.')
+@click.option('--timeout', type=click.FloatRange(0, None), default=10,
+              show_default=True, help='Seconds after which a run is killed.')
+@click.option('--json', 'as_json', is_flag=True, help='Output as JSON.')
+@click.pass_obj
+def profile(repo, script, all_, runs, script_args, top, timeout, as_json):
+    """Measures the startup latency of installed scripts.
+
+    Every script is run several times without stdin, with
+    `PYTHONPROFILEIMPORTTIME` set for python scripts where the interpreter
+    supports it, to report cold and warm start times and the modules that
+    are heaviest to import.  Save the JSON output to compare startup times
+    across upgrades.
+    """
+    if bool(script) == all_:
+        raise click.UsageError('Pass either a script or --all.')
+    scripts = sorted(repo.iter_scripts()) if all_ else [script]
+    args = shlex.split(script_args)
+    results = []
+    for name in scripts:
+        result = repo.profile(name, runs, args, top, timeout)
+        results.append(result)
+        if as_json:
+            continue
+        click.echo('%s from %s %s (%d runs):' % (
+            name, result['package'], result['version'] or '',
+            result['runs']))
+        if result['warm'] is not None:
+            click.echo('  cold: %s  warm p50: %s  p90: %s  max: %s' % (
+                format_duration(result['cold']),
+                format_duration(result['warm']['p50']),
+                format_duration(result['warm']['p90']),
+                format_duration(result['warm']['max'])))
+        if result['timed_out']:
+            click.echo('  killed after %ss' % timeout)
+        elif result['returncode']:
+            click.echo('  exited with status %d' % result['returncode'])
+        if result['imports']:
+            click.echo('  heaviest imports (self / cumulative):')
+        for module in result['imports']:
+            click.echo('    %9s %9s  %s' % (
+                format_duration(module['self']),
+                format_duration(module['cumulative']), module['module']))
+    if as_json:
+        click.echo(json.dumps(results if all_ else results[0], indent=2,
+                              sort_keys=True))
+
+
+def open_archive(filename, mode):
+    if filename == '-':
+        stream = sys.stdout if 'w' in mode else sys.stdin
+        return getattr(stream, 'buffer', stream)
+    return open(filename, mode)
+
+
+@cli.command('export')
+@click.argument('archive', type=click.Path(dir_okay=False, allow_dash=True))
+@click.pass_obj
+def export_cmd(repo, archive):
+    """Exports all installed packages into ARCHIVE.
+
+    The archive can be imported on another host with `pipsi import`, even
+    into another home or bin dir.  The compression is picked by extension
+    (.tar, .tar.gz, .tar.bz2 or .tar.xz), `-` streams gzip to stdout.
+    """
+    with open_archive(archive, 'wb') as fh:
+        packages = repo.export(fh, get_archive_mode(archive))
+    click.echo('Exported %d packages.' % len(packages), err=True)
+
+
+@cli.command('import')
+@click.argument('archive', type=click.Path(dir_okay=False, allow_dash=True))
+@click.pass_obj
+def import_cmd(repo, archive):
+    """Imports packages from an ARCHIVE created by `pipsi export`.
+
+    Shebangs, `pyvenv.cfg` and links are rewritten for the new home and
+    bin dir while unpacking.
+    """
+    with open_archive(archive, 'rb') as fh:
+        packages = repo.import_(fh)
+    click.echo('Imported %d packages.' % len(packages))
+
+
+@cli.command()
+@click.argument('package')
+@click.option('--output', '-o', type=click.Path(dir_okay=False),
+              help='Where to write the zipapp.  Defaults to PACKAGE.pyz')
+@click.option('--entry-point', help='The console script to run by default.')
+@click.option('--python', help='The interpreter for the shebang line.  '
+              'Defaults to the same python version as the virtualenv.')
+@click.option('--extract-native', is_flag=True,
+              help='Allow native extensions by unpacking the zipapp into a '
+                   'cache folder when it runs.')
+@click.option('--compress', is_flag=True,
+              help='Compress the archive, at the cost of import speed.')
+@click.pass_obj
+def pack(repo, package, output, entry_point, python, extract_native,
+         compress):
+    """Builds a self-contained zipapp of an installed package.
+
+    The zipapp contains the package with all its dependencies and runs
+    the console script named like the file it is invoked as, or the
+    default entry point.
+    """
+    if output is None:
+        output = normalize_package(package) + '.pyz'
+    if repo.pack(package, output, entry_point, python, extract_native,
+                 compress):
+        click.echo('Packed %s into %s' % (package, output))
+    else:
+        sys.exit(1)
+
 
 if __name__ == '__main__':
     cli()
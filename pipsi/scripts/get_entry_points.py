@@ -0,0 +1,9 @@
+import json
+import sys
+import pkg_resources
+pkg = sys.argv[1]
+dist = pkg_resources.get_distribution(pkg)
+print(json.dumps(dict(
+    (name, str(ep).split('=', 1)[1].strip())
+    for name, ep in dist.get_entry_map('console_scripts').items()
+)))
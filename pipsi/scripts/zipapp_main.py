@@ -0,0 +1,49 @@
+# Generated by `pipsi pack`
+import os
+import sys
+
+ENTRY_POINTS = __ENTRY_POINTS__
+DEFAULT_ENTRY_POINT = __DEFAULT_ENTRY_POINT__
+EXTRACT = __EXTRACT__
+
+
+def extract(archive):
+    # Native extensions cannot be imported from a zip, so the archive is
+    # unpacked once into a cache folder keyed by its size and mtime.
+    import shutil
+    import zipfile
+    st = os.stat(archive)
+    cache = os.environ.get('PIPSI_PACK_CACHE') or os.path.join(
+        os.path.expanduser('~'), '.cache', 'pipsi-pack')
+    target = os.path.join(cache, '%s-%d-%d' % (
+        os.path.basename(archive), st.st_size, int(st.st_mtime)))
+    if not os.path.isdir(target):
+        tmp = '%s.%d.tmp' % (target, os.getpid())
+        zf = zipfile.ZipFile(archive)
+        try:
+            zf.extractall(tmp)
+        finally:
+            zf.close()
+        try:
+            os.rename(tmp, target)
+        except OSError:
+            # Another process was faster
+            shutil.rmtree(tmp, True)
+    return target
+
+
+def main():
+    archive = os.path.dirname(os.path.abspath(__file__))
+    if EXTRACT:
+        sys.path[0] = extract(archive)
+    name = os.path.splitext(os.path.basename(sys.argv[0]))[0]
+    entry_point = ENTRY_POINTS.get(name, ENTRY_POINTS[DEFAULT_ENTRY_POINT])
+    module, _, attrs = entry_point.split()[0].partition(':')
+    obj = __import__(module, fromlist=['__name__'])
+    for attr in filter(None, attrs.split('.')):
+        obj = getattr(obj, attr)
+    sys.exit(obj())
+
+
+if __name__ == '__main__':
+    main()
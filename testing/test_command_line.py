@@ -1,3 +1,4 @@
+import json
 import subprocess
 
 import pytest
@@ -10,3 +11,10 @@ def test_list_command(home):
         'pipsi', '--home', home.strpath, 'list'
     ])
     assert output.strip() == b'There are no scripts installed through pipsi'
+
+
+def test_list_command_json(home):
+    output = subprocess.check_output([
+        'pipsi', '--home', home.strpath, 'list', '--json'
+    ])
+    assert json.loads(output.decode('utf-8')) == []
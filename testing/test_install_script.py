@@ -1,9 +1,24 @@
 import os.path
+import shutil
 import sys
 import subprocess
+import pytest
 from pipsi import IS_WIN
 
 
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def copy_source(tmpdir):
+    """A copy of the source tree, so building it leaves no `build/`
+    folder behind in the checkout.
+    """
+    src = str(tmpdir.join('src'))
+    shutil.copytree(ROOT, src, ignore=shutil.ignore_patterns(
+        '.git', 'build', '*.egg-info', '__pycache__', '.pytest_cache'))
+    return src
+
+
 def test_create_env(tmpdir):
     subprocess.check_call([
         sys.executable, 'get-pipsi.py',
@@ -15,3 +30,35 @@ def test_create_env(tmpdir):
     pipsi_bin = str(tmpdir.join('test_bin/pipsi' + ('.exe' if IS_WIN else '')))
 
     subprocess.check_call([pipsi_bin])
+
+
+@pytest.mark.skipif(IS_WIN, reason='templates are not supported on windows')
+def test_create_env_from_template(tmpdir):
+    subprocess.check_call([
+        sys.executable, 'get-pipsi.py',
+        '--home', str(tmpdir.join('template')),
+        '--bin-dir', str(tmpdir.join('template_bin')),
+        '--src', copy_source(tmpdir),
+        '--ignore-existing',
+    ])
+    subprocess.check_call([
+        sys.executable, 'get-pipsi.py',
+        '--home', str(tmpdir.join('venv')),
+        '--bin-dir', str(tmpdir.join('test_bin')),
+        '--venv-template', str(tmpdir.join('template', 'pipsi')),
+        '--ignore-existing',
+    ])
+    tmpdir.join('template').remove()
+    pipsi_bin = str(tmpdir.join('test_bin/pipsi' + ('.exe' if IS_WIN else '')))
+
+    subprocess.check_call([pipsi_bin, '--version'])
+
+    # An existing venv is left alone
+    assert subprocess.call([
+        sys.executable, 'get-pipsi.py',
+        '--home', str(tmpdir.join('venv')),
+        '--bin-dir', str(tmpdir.join('other_bin')),
+        '--venv-template', str(tmpdir.join('venv', 'pipsi')),
+        '--ignore-existing',
+    ]) != 0
+    subprocess.check_call([pipsi_bin, '--version'])